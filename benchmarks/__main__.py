@@ -0,0 +1,204 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Time the tracers on synthetic dependency graphs.
+
+Run from the root of the repository with
+
+    python -m benchmarks
+
+Nothing on the machine is read, so neither apt nor an initialized rosdep
+database is needed.
+"""
+
+from __future__ import print_function
+
+import argparse
+import gc
+import json
+import sys
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:
+    # python 2
+    tracemalloc = None
+
+from py3_ready.apt_tracer import AptTracer
+from py3_ready.dependency_tracer import TracerCache
+from py3_ready.package_xml import PackageTracer
+from py3_ready.rosdep import RosdepTracer
+
+from .fakes import deep_chain
+from .fakes import FakeAptCache
+from .fakes import FakePackageCache
+from .fakes import FakeRosdepResolver
+from .fakes import heavy_virtual
+from .fakes import large_cycles
+from .fakes import wide_fan_out
+
+
+def make_worlds(scale):
+    """Return the graphs to benchmark, with sizes multiplied by scale."""
+    def scaled(n):
+        return max(1, int(n * scale))
+    return [
+        deep_chain(scaled(20000)),
+        wide_fan_out(layers=6, width=scaled(2000), fan=4),
+        large_cycles(num_cycles=scaled(20), size=1000),
+        heavy_virtual(num_virtual=scaled(200), providers=50),
+    ]
+
+
+def make_tracer(world, command):
+    apt_cache = FakeAptCache(world.graph, world.provides)
+    resolver = FakeRosdepResolver(world.rules)
+    if command == 'check-apt':
+        return AptTracer(apt_cache=apt_cache), world.start
+    if command == 'check-rosdep':
+        return RosdepTracer(apt_cache=apt_cache, resolver=resolver), world.start_key
+    package_cache = FakePackageCache(world.workspace)
+    return PackageTracer(
+        apt_cache=apt_cache, resolver=resolver, package_cache=package_cache), world.start_package
+
+
+def run_mode(tracer, start, target, mode):
+    """Trace like the command line would in the given mode."""
+    cache = TracerCache()
+    if mode == 'trace':
+        return bool(tracer.trace_targets(start, [target], cache=cache)[target])
+    if mode == 'shortest':
+        return bool(tracer.trace_shortest_paths(start, target, k=1, cache=cache))
+    return tracer.depends_on_any(start, [target], cache=cache)
+
+
+def measure(world, command, mode, repeat):
+    """Return (depends, best time in seconds, peak bytes allocated or None)."""
+    best = None
+    for _ in range(repeat):
+        # Building the fakes isn't part of what is measured
+        tracer, start = make_tracer(world, command)
+        gc.collect()
+        begin = timeit.default_timer()
+        depends = run_mode(tracer, start, world.target, mode)
+        elapsed = timeit.default_timer() - begin
+        if best is None or elapsed < best:
+            best = elapsed
+
+    peak = None
+    if tracemalloc is not None:
+        # Measured separately since tracing allocations slows everything down
+        tracer, start = make_tracer(world, command)
+        gc.collect()
+        tracemalloc.start()
+        try:
+            run_mode(tracer, start, world.target, mode)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return depends, best, peak
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """Return descriptions of results more than tolerance worse than the baseline."""
+    old = dict(
+        ((r['world'], r['command'], r['mode']), r) for r in baseline)
+    regressions = []
+    for result in results:
+        previous = old.get((result['world'], result['command'], result['mode']))
+        if previous is None:
+            continue
+        for field in ('seconds', 'peak_bytes'):
+            if result[field] is None or not previous[field]:
+                continue
+            if result[field] > previous[field] * (1 + tolerance):
+                regressions.append('{} {} {}: {} went from {:.4g} to {:.4g}'.format(
+                    result['world'], result['command'], result['mode'], field,
+                    previous[field], result[field]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks',
+        description='Time the tracers on synthetic dependency graphs.')
+    parser.add_argument(
+        '--scale', type=float, default=1.0,
+        help='multiply the size of every graph by this (default 1)')
+    parser.add_argument(
+        '--repeat', type=int, default=3,
+        help='number of times to run each benchmark, keeping the fastest (default 3)')
+    parser.add_argument(
+        '--command', action='append',
+        choices=('check-apt', 'check-rosdep', 'check-package'),
+        help='only benchmark this command, may be given more than once')
+    parser.add_argument(
+        '--mode', action='append', choices=('trace', 'shortest', 'fail-fast'),
+        help='only benchmark this mode, may be given more than once')
+    parser.add_argument(
+        '--json', type=str, metavar='FILE',
+        help='also save the results to a file')
+    parser.add_argument(
+        '--baseline', type=str, metavar='FILE',
+        help='results saved by --json to compare against; '
+             'the exit code is 1 if anything got slower or uses more memory')
+    parser.add_argument(
+        '--tolerance', type=float, default=0.25,
+        help='fraction a result may be worse than the baseline by (default 0.25)')
+    args = parser.parse_args()
+
+    commands = args.command or ['check-apt', 'check-rosdep', 'check-package']
+    modes = args.mode or ['trace', 'shortest', 'fail-fast']
+
+    results = []
+    row = '{:<14} {:<14} {:<10} {:>9} {:>10} {:>10}'
+    print(row.format('graph', 'command', 'mode', 'packages', 'seconds', 'peak MiB'))
+    for world in make_worlds(args.scale):
+        for command in commands:
+            for mode in modes:
+                depends, seconds, peak = measure(world, command, mode, args.repeat)
+                if not depends:
+                    sys.stderr.write('{} {} {} did not find the target\n'.format(
+                        world.name, command, mode))
+                    return 2
+                results.append({
+                    'world': world.name,
+                    'command': command,
+                    'mode': mode,
+                    'packages': world.num_apt_packages(),
+                    'seconds': seconds,
+                    'peak_bytes': peak,
+                })
+                print(row.format(
+                    world.name, command, mode, world.num_apt_packages(),
+                    '{:.4f}'.format(seconds),
+                    '-' if peak is None else '{:.1f}'.format(peak / 1024.0 / 1024.0)))
+
+    if args.json:
+        with open(args.json, 'w') as fout:
+            json.dump(results, fout, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as fin:
+            regressions = compare_to_baseline(results, json.load(fin), args.tolerance)
+        for regression in regressions:
+            print(regression)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,262 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-memory stand-ins for apt, rosdep, and a workspace, and graphs to fill them."""
+
+import random
+
+from catkin_pkg.package import Dependency
+from catkin_pkg.package import Package
+from rosdep2.platforms.debian import AptInstaller
+
+
+class FakeBaseDependency(object):
+
+    def __init__(self, name, rawtype):
+        self.name = name
+        self.rawtype = rawtype
+
+
+class FakeDependency(list):
+    """An or-group of base dependencies, like apt.package.Dependency."""
+
+    def __init__(self, rawtype, names):
+        super(FakeDependency, self).__init__(
+            FakeBaseDependency(name, rawtype) for name in names)
+        self.rawtype = rawtype
+
+    def __str__(self):
+        return '{}: {}'.format(self.rawtype, ' | '.join(dep.name for dep in self))
+
+
+class FakeVersion(object):
+
+    def __init__(self, dependencies):
+        self.dependencies = [
+            FakeDependency(rawtype, names) for rawtype, names in dependencies]
+
+    def get_dependencies(self, *rawtypes):
+        return [dependency for dependency in self.dependencies if dependency.rawtype in rawtypes]
+
+
+class FakePackage(object):
+
+    def __init__(self, name, dependencies):
+        self.name = name
+        self.candidate = FakeVersion(dependencies)
+
+
+class FakeAptCache(object):
+    """The parts of apt.cache.Cache used by py3-ready.
+
+    graph is {name: [(rawtype, [alternative names...]), ...]} for real
+    packages, and provides is {virtual name: [names of providing packages]}.
+    """
+
+    def __init__(self, graph, provides=None):
+        self._packages = dict(
+            (name, FakePackage(name, dependencies)) for name, dependencies in graph.items())
+        self._provides = provides or {}
+
+    def __contains__(self, name):
+        return name in self._packages
+
+    def __getitem__(self, name):
+        return self._packages[name]
+
+    def __iter__(self):
+        return iter(self._packages.values())
+
+    def is_virtual_package(self, name):
+        return name in self._provides
+
+    def get_providing_packages(self, name):
+        return [self._packages[provider] for provider in self._provides.get(name, ())]
+
+
+class FakeRosdepResolver(object):
+    """Resolves rosdep keys from {key: [apt package names]} like RosdepResolver."""
+
+    def __init__(self, rules):
+        self._rules = rules
+        self._installer = AptInstaller()
+
+    def is_initialized(self):
+        return True
+
+    def keys(self):
+        return self._rules.keys()
+
+    def resolve(self, key):
+        if key not in self._rules:
+            return None
+        return {self._installer: list(self._rules[key])}
+
+
+class FakePackageCache(object):
+    """Parsed package.xml files kept in memory, like PackageCache."""
+
+    def __init__(self, workspace):
+        # workspace is {package name: [(rawtype, dependency name), ...]}
+        self._packages = {}
+        for name, dependencies in workspace.items():
+            kwargs = {}
+            for rawtype, dependency in dependencies:
+                # exec_depend -> exec_depends
+                kwargs.setdefault(rawtype + 's', []).append(Dependency(dependency))
+            self._packages[name] = Package(
+                name=name, filename='/fake/share/{}/package.xml'.format(name), **kwargs)
+
+    def find_package(self, name):
+        return self._packages.get(name)
+
+    def find_prefix(self, name):
+        if name in self._packages:
+            return '/fake'
+
+    def package_names(self):
+        return sorted(self._packages.keys())
+
+
+class World(object):
+    """A synthetic apt archive, rosdep database, and workspace to trace.
+
+    Every apt package has a rosdep key of the same name with 'key-' in front.
+    """
+
+    def __init__(self, name, graph, provides, start, target, workspace=None, start_package=None):
+        self.name = name
+        self.graph = graph
+        self.provides = provides
+        self.start = start
+        self.target = target
+        self.rules = dict(('key-' + apt_name, [apt_name]) for apt_name in graph)
+        self.start_key = 'key-' + start
+        if workspace is None:
+            workspace, start_package = generate_workspace(
+                sorted(name for name in graph if name != target), start)
+        self.workspace = workspace
+        self.start_package = start_package
+
+    def num_apt_packages(self):
+        return len(self.graph) + len(self.provides)
+
+
+def generate_workspace(apt_names, start, num_packages=200, seed=0):
+    """Return a workspace of layered ROS packages depending on rosdep keys.
+
+    The first package depends on the others through chains of packages, and
+    the last package depends on the rosdep key of start.
+    """
+    rng = random.Random(seed)
+    names = ['pkg_{}'.format(i) for i in range(num_packages)]
+    workspace = {}
+    for i, name in enumerate(names):
+        dependencies = []
+        later = names[i + 1:]
+        for dependency in rng.sample(later, min(3, len(later))):
+            dependencies.append((rng.choice(('build_depend', 'exec_depend')), dependency))
+        for apt_name in rng.sample(apt_names, min(2, len(apt_names))):
+            dependencies.append(('exec_depend', 'key-' + apt_name))
+        dependencies.append(('test_depend', 'key-' + rng.choice(apt_names)))
+        workspace[name] = dependencies
+    workspace[names[-1]].append(('exec_depend', 'key-' + start))
+    return workspace, names[0]
+
+
+def _depends(*names):
+    return [('Depends', [name]) for name in names]
+
+
+def deep_chain(length, target='python'):
+    """A single chain of packages, length long, ending in the target."""
+    graph = {}
+    for i in range(length):
+        graph['chain{}'.format(i)] = _depends('chain{}'.format(i + 1))
+    graph['chain{}'.format(length)] = _depends(target)
+    graph[target] = []
+    return World('deep-chain', graph, {}, 'chain0', target)
+
+
+def wide_fan_out(layers, width, fan, reach=0.01, seed=0, target='python'):
+    """Layers of packages each depending on fan random packages in the next layer.
+
+    A fraction reach of the packages in the last layer depend on the target.
+    """
+    rng = random.Random(seed)
+    names = [['fan{}_{}'.format(layer, i) for i in range(width)] for layer in range(layers)]
+    graph = {'fan-start': _depends(*names[0])}
+    for layer in range(layers - 1):
+        for name in names[layer]:
+            dependencies = []
+            for dependency in rng.sample(names[layer + 1], fan):
+                if rng.random() < 0.2:
+                    # Or-group, like 'Depends: a | b'
+                    alternative = rng.choice(names[layer + 1])
+                    rawtype = rng.choice(('Depends', 'PreDepends'))
+                    dependencies.append((rawtype, [dependency, alternative]))
+                else:
+                    dependencies.append(('Depends', [dependency]))
+            graph[name] = dependencies
+    for name in names[-1]:
+        graph[name] = _depends(target) if rng.random() < reach else []
+    graph[target] = []
+    return World('wide-fan-out', graph, {}, 'fan-start', target)
+
+
+def large_cycles(num_cycles, size, seed=0, target='python'):
+    """Rings of packages depending on each other, chained one after another.
+
+    Each ring has a few extra edges across it, and only the last ring depends
+    on the target.
+    """
+    rng = random.Random(seed)
+    graph = {}
+    for c in range(num_cycles):
+        ring = ['ring{}_{}'.format(c, i) for i in range(size)]
+        for i, name in enumerate(ring):
+            dependencies = [ring[(i + 1) % size]]
+            if rng.random() < 0.1:
+                dependencies.append(rng.choice(ring))
+            graph[name] = _depends(*dependencies)
+        if c + 1 < num_cycles:
+            graph[ring[-1]].extend(_depends('ring{}_0'.format(c + 1)))
+        else:
+            graph[ring[size // 2]].extend(_depends(target))
+    graph[target] = []
+    return World('large-cycles', graph, {}, 'ring0_0', target)
+
+
+def heavy_virtual(num_virtual, providers, reach=0.05, seed=0, target='python'):
+    """Virtual packages each provided by many packages sharing a few libraries.
+
+    Providers depend on the target with probability reach.
+    """
+    rng = random.Random(seed)
+    libraries = ['lib{}'.format(i) for i in range(50)]
+    graph = dict((library, []) for library in libraries)
+    provides = {}
+    for v in range(num_virtual):
+        virtual = 'virtual{}'.format(v)
+        provides[virtual] = []
+        for p in range(providers):
+            provider = 'provider{}_{}'.format(v, p)
+            dependencies = rng.sample(libraries, 3)
+            if rng.random() < reach:
+                dependencies.append(target)
+            graph[provider] = _depends(*dependencies)
+            provides[virtual].append(provider)
+    graph['virtual-start'] = _depends(*sorted(provides))
+    graph[target] = []
+    return World('heavy-virtual', graph, provides, 'virtual-start', target)
@@ -0,0 +1,169 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Ways of reading the debian package database."""
+
+import threading
+
+try:
+    import apt_pkg
+except ImportError:
+    # Only needed to read the apt database of this machine
+    apt_pkg = None
+
+from .stats import current_stats
+
+
+# Dependency types the backends return for a package's dependencies
+DEPENDS_TYPES = ('PreDepends', 'Depends', 'Recommends', 'Suggests')
+
+
+def init_apt_pkg():
+    """Initialize apt_pkg the same way importing apt does."""
+    if 'APT' not in apt_pkg.config:
+        apt_pkg.init_config()
+    apt_pkg.init_system()
+
+
+def get_apt_database_paths():
+    """Return paths to files that change when the apt database changes."""
+    init_apt_pkg()
+    return [
+        apt_pkg.config.find_dir('Dir::State::Lists'),
+        apt_pkg.config.find_file('Dir::State::status'),
+    ]
+
+
+class AptBackend(object):
+    """Interface for looking up debian packages and their dependencies."""
+
+    def __contains__(self, name):
+        """Return True if there is a real package with this name."""
+        raise NotImplementedError()
+
+    def is_virtual_package(self, name):
+        raise NotImplementedError()
+
+    def get_providing_packages(self, name):
+        """Return names of packages whose candidate provides a virtual package."""
+        raise NotImplementedError()
+
+    def get_dependencies(self, name):
+        """Return the dependencies of the candidate version of a package.
+
+        Each dependency is an or-group given as (rawtype, names, description),
+        where description is how the dependency is written in debian/control.
+        """
+        raise NotImplementedError()
+
+
+class AptCacheBackend(AptBackend):
+    """Backend using an already opened apt.cache.Cache."""
+
+    def __init__(self, apt_cache):
+        self._apt_cache = apt_cache
+
+    def __contains__(self, name):
+        return name in self._apt_cache
+
+    def is_virtual_package(self, name):
+        return self._apt_cache.is_virtual_package(name)
+
+    def get_providing_packages(self, name):
+        return [pkg.name for pkg in self._apt_cache.get_providing_packages(name)]
+
+    def get_dependencies(self, name):
+        candidate = self._apt_cache[name].candidate
+        if candidate is None:
+            return []
+        # candidate.dependencies is only PreDepends and Depends
+        return [
+            (dependency.rawtype, [base_dep.name for base_dep in dependency], str(dependency))
+            for dependency in candidate.get_dependencies(*DEPENDS_TYPES)]
+
+
+class AptPkgBackend(AptBackend):
+    """Backend reading records from apt_pkg only when they are needed.
+
+    This skips creating python-apt Package objects, and the apt cache is only
+    opened the first time a package is looked up.
+    It may be used from several threads.
+    """
+
+    def __init__(self):
+        self._cache = None
+        self._depcache = None
+        self._open_lock = threading.Lock()
+
+    def _open(self):
+        if self._depcache is not None:
+            return
+        with self._open_lock:
+            if self._depcache is None:
+                with current_stats().phase('open apt cache'):
+                    init_apt_pkg()
+                    # No progress reporting
+                    self._cache = apt_pkg.Cache(None)
+                    self._depcache = apt_pkg.DepCache(self._cache)
+
+    def _get(self, name):
+        self._open()
+        try:
+            return self._cache[name]
+        except KeyError:
+            return None
+
+    def __contains__(self, name):
+        pkg = self._get(name)
+        return pkg is not None and pkg.has_versions
+
+    def is_virtual_package(self, name):
+        pkg = self._get(name)
+        return pkg is not None and bool(pkg.has_provides and not pkg.has_versions)
+
+    def get_providing_packages(self, name):
+        pkg = self._get(name)
+        if pkg is None or pkg.has_versions:
+            return []
+        providers = set()
+        for _, _, version in pkg.provides_list:
+            provider = version.parent_pkg
+            # Same as python-apt: only count providers whose candidate provides it
+            if version == self._depcache.get_candidate_ver(provider):
+                providers.add(provider.name)
+        return list(providers)
+
+    def get_dependencies(self, name):
+        pkg = self._get(name)
+        if pkg is None:
+            raise KeyError(name)
+        candidate = self._depcache.get_candidate_ver(pkg)
+        if candidate is None:
+            return []
+        depends_list = candidate.depends_list
+        dependencies = []
+        for rawtype in DEPENDS_TYPES:
+            for or_group in depends_list.get(rawtype, ()):
+                names = []
+                rawstrs = []
+                for dep in or_group:
+                    names.append(dep.target_pkg.name)
+                    if dep.target_ver:
+                        rawstrs.append('{} {} {}'.format(
+                            dep.target_pkg.name, dep.comp_type_deb, dep.target_ver))
+                    else:
+                        rawstrs.append(dep.target_pkg.name)
+                dependencies.append(
+                    (rawtype, names, '{}: {}'.format(rawtype, ' | '.join(rawstrs))))
+        return dependencies
@@ -0,0 +1,302 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Trace debian dependencies from Packages files without python-apt."""
+
+from __future__ import print_function
+
+import gzip
+import io
+import marshal
+import os
+import re
+import sys
+import tempfile
+
+from .apt_backend import AptBackend
+from .apt_backend import DEPENDS_TYPES
+from .stats import current_stats
+
+# Written at the start of every snapshot file
+SNAPSHOT_MAGIC = b'py3-ready apt snapshot\n'
+# Bump when the layout of the snapshot changes
+SNAPSHOT_FORMAT_VERSION = 2
+
+# Splits a version into alternating non-digit and digit parts
+_VERSION_PART = re.compile(r'(\D*)(\d*)')
+
+# Parses one alternative of a dependency like 'python3:any (>= 3.6)'
+_DEPENDENCY = re.compile(
+    r'^(?P<name>[^\s:(\[<]+)(:(?P<arch>[^\s(]+))?\s*(\((?P<relation>[<>=]+)\s*(?P<version>[^)\s]+)\s*\))?')
+
+
+def _char_order(c):
+    # Same ordering of non-digits as dpkg: ~ sorts before everything,
+    # then the end of the string, then letters, then everything else
+    if c == '~':
+        return -1
+    if c.isalpha():
+        return ord(c)
+    return ord(c) + 256
+
+
+def _compare_part(a, b):
+    a_parts = _VERSION_PART.findall(a)
+    b_parts = _VERSION_PART.findall(b)
+    length = max(len(a_parts), len(b_parts))
+    a_parts += [('', '')] * (length - len(a_parts))
+    b_parts += [('', '')] * (length - len(b_parts))
+    for (a_text, a_digits), (b_text, b_digits) in zip(a_parts, b_parts):
+        a_order = [_char_order(c) for c in a_text]
+        b_order = [_char_order(c) for c in b_text]
+        width = max(len(a_order), len(b_order))
+        a_order += [0] * (width - len(a_order))
+        b_order += [0] * (width - len(b_order))
+        if a_order != b_order:
+            return -1 if a_order < b_order else 1
+        a_number = int(a_digits or '0')
+        b_number = int(b_digits or '0')
+        if a_number != b_number:
+            return -1 if a_number < b_number else 1
+    return 0
+
+
+def _split_version(version):
+    epoch = 0
+    if ':' in version:
+        epoch, version = version.split(':', 1)
+        epoch = int(epoch)
+    revision = ''
+    if '-' in version:
+        version, revision = version.rsplit('-', 1)
+    return epoch, version, revision
+
+
+def compare_versions(a, b):
+    """Compare two debian versions like apt_pkg.version_compare."""
+    a_epoch, a_upstream, a_revision = _split_version(a)
+    b_epoch, b_upstream, b_revision = _split_version(b)
+    if a_epoch != b_epoch:
+        return -1 if a_epoch < b_epoch else 1
+    return _compare_part(a_upstream, b_upstream) or _compare_part(a_revision, b_revision)
+
+
+def open_packages_file(path):
+    """Open a Packages file for reading text, decompressing it if needed."""
+    if path.endswith('.gz'):
+        return io.TextIOWrapper(gzip.open(path, 'rb'), encoding='utf-8')
+    if path.endswith('.xz'):
+        # Not available on python 2
+        import lzma
+        return io.TextIOWrapper(lzma.open(path, 'rb'), encoding='utf-8')
+    return io.open(path, 'r', encoding='utf-8')
+
+
+def read_stanzas(fin):
+    """Yield {field: value} for each paragraph of a debian control file."""
+    stanza = {}
+    field = None
+    for line in fin:
+        line = line.rstrip('\n')
+        if not line.strip():
+            if stanza:
+                yield stanza
+            stanza = {}
+            field = None
+        elif line[0] in ' \t':
+            # Continuation of a multi-line field
+            if field is not None:
+                stanza[field] += '\n' + line
+        else:
+            field, _, value = line.partition(':')
+            stanza[field] = value.strip()
+    if stanza:
+        yield stanza
+
+
+def parse_relations(text):
+    """Return a list of or-groups, each a list of (name, rawstr)."""
+    relations = []
+    for group in text.split(','):
+        alternatives = []
+        for alternative in group.split('|'):
+            match = _DEPENDENCY.match(alternative.strip())
+            if match is None:
+                continue
+            name = match.group('name')
+            if match.group('arch') == 'any':
+                # Same as apt, which has a package name:any provided by every
+                # package allowing it to satisfy dependencies of any arch
+                name += ':any'
+            if match.group('relation'):
+                rawstr = '{} {} {}'.format(
+                    name, match.group('relation'), match.group('version'))
+            else:
+                rawstr = name
+            alternatives.append((name, rawstr))
+        if alternatives:
+            relations.append(alternatives)
+    return relations
+
+
+class AptSnapshot(AptBackend):
+    """Compact index of debian packages read from Packages files.
+
+    Only the candidate (highest) version of each package is kept, the same as
+    the default apt backends.
+    Names are stored once in a list and referred to by their index, and the
+    whole index is saved with marshal so it loads quickly.
+    """
+
+    def __init__(self, names, dependencies, providers):
+        # Index is a name id
+        self._names = names
+        # Key: id of a real package, Value: ((rawtype, (name ids...), description), ...)
+        self._dependencies = dependencies
+        # Key: id of a virtual package, Value: (ids of packages providing it, ...)
+        self._providers = providers
+        self._ids = dict((name, i) for i, name in enumerate(names))
+
+    @classmethod
+    def from_packages_files(cls, paths):
+        """Build a snapshot from Packages files or a dpkg status file."""
+        # Key: package name, Value: stanza of the candidate version
+        candidates = {}
+        for path in paths:
+            with open_packages_file(path) as fin:
+                for stanza in read_stanzas(fin):
+                    name = stanza.get('Package')
+                    version = stanza.get('Version')
+                    if not name or not version:
+                        continue
+                    status = stanza.get('Status')
+                    if status is not None and not status.endswith(' installed'):
+                        # Removed package in a dpkg status file
+                        continue
+                    current = candidates.get(name)
+                    if current is None or compare_versions(version, current['Version']) > 0:
+                        candidates[name] = stanza
+
+        names = []
+        ids = {}
+
+        def name_id(name):
+            if name not in ids:
+                ids[name] = len(names)
+                names.append(name)
+            return ids[name]
+
+        dependencies = {}
+        providers = {}
+        for name in sorted(candidates):
+            stanza = candidates[name]
+            package_dependencies = []
+            for rawtype in DEPENDS_TYPES:
+                field = 'Pre-Depends' if rawtype == 'PreDepends' else rawtype
+                if field not in stanza:
+                    continue
+                for group in parse_relations(stanza[field]):
+                    package_dependencies.append((
+                        rawtype,
+                        tuple(name_id(dep_name) for dep_name, _ in group),
+                        '{}: {}'.format(rawtype, ' | '.join(rawstr for _, rawstr in group))))
+            dependencies[name_id(name)] = tuple(package_dependencies)
+            provides = [
+                provided
+                for group in parse_relations(stanza.get('Provides', ''))
+                for provided, _ in group]
+            if stanza.get('Multi-Arch') == 'allowed':
+                provides += [provided + ':any' for provided in [name] + provides]
+            for provided in provides:
+                providers.setdefault(name_id(provided), []).append(name_id(name))
+
+        # A name is only virtual if no real package has it
+        providers = dict(
+            (provided, tuple(sorted(set(provider_ids))))
+            for provided, provider_ids in providers.items()
+            if provided not in dependencies)
+        return cls(names, dependencies, providers)
+
+    @classmethod
+    def load(cls, path):
+        """Load a snapshot saved by save()."""
+        with current_stats().phase('load apt snapshot'), open(path, 'rb') as fin:
+            if fin.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                raise ValueError('{} is not an apt snapshot'.format(path))
+            data = marshal.load(fin)
+        if data.get('version') != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError('{} was made by a different version of py3-ready'.format(path))
+        return cls(data['names'], data['dependencies'], data['providers'])
+
+    def save(self, path):
+        data = {
+            'version': SNAPSHOT_FORMAT_VERSION,
+            'names': self._names,
+            'dependencies': self._dependencies,
+            'providers': self._providers,
+        }
+        # Write to a temporary file first so it's never read half written
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            with os.fdopen(fd, 'wb') as fout:
+                fout.write(SNAPSHOT_MAGIC)
+                marshal.dump(data, fout)
+            os.rename(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+    def package_names(self):
+        return sorted(self._names[i] for i in self._dependencies)
+
+    def __contains__(self, name):
+        return self._ids.get(name) in self._dependencies
+
+    def is_virtual_package(self, name):
+        return self._ids.get(name) in self._providers
+
+    def get_providing_packages(self, name):
+        return [self._names[i] for i in self._providers.get(self._ids.get(name), ())]
+
+    def get_dependencies(self, name):
+        if name not in self:
+            raise KeyError(name)
+        names = self._names
+        return [
+            (rawtype, [names[i] for i in name_ids], description)
+            for rawtype, name_ids, description in self._dependencies[self._ids[name]]]
+
+
+class BuildSnapshotCommand(object):
+
+    def __init__(self, parser):
+        parser.add_argument(
+            'output', type=str,
+            help='file to save the snapshot to')
+        parser.add_argument(
+            'packages_files', type=str, nargs='+',
+            help='Packages files (plain, .gz, or .xz) or a dpkg status file')
+        parser.add_argument('--quiet', action='store_true')
+
+    def do_command(self, args):
+        try:
+            snapshot = AptSnapshot.from_packages_files(args.packages_files)
+            snapshot.save(args.output)
+        except (IOError, OSError) as e:
+            sys.stderr.write(str(e) + '\n')
+            return 2
+        if not args.quiet:
+            print('Saved {} packages to {}'.format(
+                len(snapshot.package_names()), args.output))
+        return 0
@@ -17,120 +17,247 @@
 from __future__ import print_function
 
 import copy
+import multiprocessing
+import os
 import sys
 
+from .apt_backend import AptCacheBackend
+from .apt_backend import apt_pkg
+from .apt_backend import AptPkgBackend
+from .apt_backend import get_apt_database_paths
+from .apt_snapshot import AptSnapshot
 from .dependency_tracer import DependencyTracer
-from .dependency_tracer import Edge
+from .dependency_tracer import cached_verdicts
+from .dependency_tracer import format_path
+from .dependency_tracer import known_dead_ends
 from .dependency_tracer import Node
+from .dependency_tracer import paths_to_targets
+from .dependency_tracer import reaches_target
+from .dependency_tracer import shortest_paths
+from .dependency_tracer import trace
 from .dependency_tracer import TracerCache
-from .dot import paths_to_dot
-
-from apt.cache import Cache
-from apt.package import Package
+from .cli import please_install
+from .disk_cache import PersistentTracerCache
+from .dot import write_graph
+from .resources import Resources
+from .stats import current_stats
 
 APT_NODE = 'apt'
 
+# Only walk upstream dependencies
+APT_DEPENDENCY_TYPES = ('Depends', 'PreDepends', 'Suggests', 'Recommends')
+
+# Followed unless others are asked for, since Suggests and Recommends aren't
+# installed by default
+DEFAULT_APT_DEPENDENCY_TYPES = ('Depends', 'PreDepends')
+
 
 class AptTracer(DependencyTracer):
+    """Trace dependencies between debian packages.
 
-    def __init__(self, apt_cache=None, quiet=True):
-        if not apt_cache:
-            apt_cache = Cache()
-        self._apt_cache = apt_cache
+    Only dependencies of the given dependency_types are followed, so packages
+    only reachable through other kinds of dependencies are never looked at.
+    A TracerCache must only be shared by tracers following the same types.
+    """
+
+    def __init__(self, apt_cache=None, quiet=True, backend=None, dependency_types=None):
+        if backend is None:
+            if apt_cache is not None:
+                backend = AptCacheBackend(apt_cache)
+            else:
+                # Opens the apt cache only when a package is first looked up
+                backend = AptPkgBackend()
+        self._backend = backend
         self._quiet = quiet
+        if dependency_types is None:
+            dependency_types = DEFAULT_APT_DEPENDENCY_TYPES
+        self._dependency_types = frozenset(dependency_types)
 
-    def trace_paths(self, start, target, cache=None):
-        if start in self._apt_cache:
-            start_pkg = self._apt_cache[start]
-        else:
-            msg = "'{}' not in apt cache.".format(start)
-            if not self._quiet:
-                sys.stderr.write(msg + '\n')
-            raise KeyError(msg)
-        if target in self._apt_cache:
-            target_pkg = self._apt_cache[target]
-        else:
-            msg = "'{}' not in apt cache.".format(target)
+    def trace_targets(self, start, targets, cache=None):
+        if not cache:
+            cache = TracerCache()
+        start_node, bits, _ = self.trace_into_cache(start, targets, cache)
+        return paths_to_targets(start_node, bits, APT_NODE, cache)
+
+    def trace_into_cache(self, start, targets, cache):
+        bits = cache.target_bits(targets)
+        target_mask = apt_targets(bits)
+        start_node = Node(start, APT_NODE)
+        if not cache.check_fully_explored(start_node):
+            self.check_in_apt_cache(start)
+            for target in targets:
+                self.check_in_apt_cache(target)
+            # Descend through dependency
+            trace(start_node, target_mask, self.successors, cache)
+        # If the answer was cached then the apt cache is never opened
+        return start_node, bits, target_mask
+
+    def depends_on_any(self, start, targets, cache=None):
+        self.check_in_apt_cache(start)
+        for target in targets:
+            self.check_in_apt_cache(target)
+        return reaches_target(
+            Node(start, APT_NODE), apt_targets(dict((t, 1) for t in targets)),
+            self.successors, verdict=cached_verdicts(cache, targets))
+
+    def trace_shortest_paths(self, start, target, k=1, cache=None):
+        self.check_in_apt_cache(start)
+        self.check_in_apt_cache(target)
+        return shortest_paths(
+            Node(start, APT_NODE), apt_targets({target: 1}), self.successors,
+            k=k, is_dead_end=known_dead_ends(cache, target))
+
+    def check_in_apt_cache(self, name):
+        if name not in self._backend:
+            msg = "'{}' not in apt cache.".format(name)
             if not self._quiet:
                 sys.stderr.write(msg + '\n')
             raise KeyError(msg)
 
-        self._edges_to_target = []
-        self._deferred_pkgs = set()
-        if not cache:
-            cache = TracerCache()
-        self._cache = cache
-
-        # Descend through dependency
-        self._trace_path(start_pkg, target_pkg)
-        # Need extra passes for circular dependencies
-        while self._deferred_pkgs:
-            def_pkgs = self._deferred_pkgs
-            self._deferred_pkgs = set()
-            for def_pkg in def_pkgs:
-                self._trace_path(def_pkg, target_pkg)
-        # TODO(sloretz) why are edges sometimes repeated?
-        return list(set(self._edges_to_target))
-
-    def _trace_path(self, start, target):
-        """Depth first search to trace paths to target."""
-        if start.name == target.name:
-            # Found target
-            return True
-        start_node = Node(start.name, APT_NODE)
-        if self._cache.check_visited(start_node):
-            if self._cache.check_fully_explored(start_node):
-                leads_to_target = self._cache.check_leads_to_target(start_node)
-                if leads_to_target:
-                    self._edges_to_target.extend(self._cache.recursive_edges(start_node))
-                return leads_to_target
-            else:
-                # Defer checks on circular dependencies
-                self._deferred_pkgs.add(start)
-                return False
-        self._cache.visit(start_node)
-        if not start.candidate.dependencies:
-            # lowest level and target not found
-            self._cache.mark_leads_to_target(start_node, False)
-            return False
-        leads_to_target = False
-        for dependency in start.candidate.dependencies:
+    def successors(self, node):
+        if self._backend.is_virtual_package(node.name):
+            # Any package providing a virtual package can satisfy it
+            current_stats().count('virtual packages expanded')
+            for name in self._backend.get_providing_packages(node.name):
+                yield 'virtual', Node(name, APT_NODE)
+            return
+        for rawtype, names, description in self._backend.get_dependencies(node.name):
+            if rawtype not in self._dependency_types:
+                continue
             # Check all the candidates that can satisfy this dependency
-            for base_dep in dependency:
-                # Only walk upstream dependencies
-                if base_dep.rawtype in ['Depends', 'PreDepends', 'Suggests', 'Recommends']:
-                    if self._apt_cache.is_virtual_package(base_dep.name):
-                        virtual_to_target = False
-                        base_dep_node = Node(base_dep.name, APT_NODE)
-                        for pkg in self._apt_cache.get_providing_packages(base_dep.name):
-                            if self._trace_path(pkg, target):
-                                leads_to_target = True
-                                edge1 = Edge(start_node, base_dep.rawtype, base_dep_node)
-                                pkg_node = Node(pkg.name, APT_NODE)
-                                edge2 = Edge(base_dep_node, 'virtual', pkg_node)
-                                self._cache.add_edge(edge1)
-                                self._cache.add_edge(edge2)
-                                self._edges_to_target.append(edge1)
-                                self._edges_to_target.append(edge2)
-                                virtual_to_target = True
-                        self._cache.mark_leads_to_target(base_dep_node, virtual_to_target)
-                    else:
-                        if base_dep.name in self._apt_cache:
-                            pkg = self._apt_cache[base_dep.name]
-                        else:
-                            if not self._quiet:
-                                sys.stderr.write(
-                                    "'{}' not in apt cache. Used by '{}' as '{}'\n".format(
-                                        base_dep.name, start.name, dependency))
-                            continue
-                        if self._trace_path(pkg, target):
-                            leads_to_target = True
-                            pkg_node = Node(pkg.name, APT_NODE)
-                            edge = Edge(start_node, base_dep.rawtype, pkg_node)
-                            self._cache.add_edge(edge)
-                            self._edges_to_target.append(edge)
-        self._cache.mark_leads_to_target(start_node, leads_to_target)
-        return leads_to_target
+            for name in names:
+                if name not in self._backend and \
+                        not self._backend.is_virtual_package(name):
+                    if not self._quiet:
+                        sys.stderr.write(
+                            "'{}' not in apt cache. Used by '{}' as '{}'\n".format(
+                                name, node.name, description))
+                    continue
+                yield rawtype, Node(name, APT_NODE)
+
+
+def apt_targets(target_bits):
+    """Return a callable giving the target bits of an apt package node."""
+    def target_mask(node):
+        if node.node_type == APT_NODE:
+            return target_bits.get(node.name, 0)
+        return 0
+    return target_mask
+
+
+def dependency_types_key(dependency_types, default):
+    """Return a string identifying which dependency types are followed.
+
+    Results traced following different types can't be mixed, so this is part
+    of the name of persistent caches.
+    """
+    if dependency_types is None:
+        dependency_types = default
+    return ','.join(sorted(set(dependency_types)))
+
+
+def create_apt_disk_cache(targets, quiet=True, snapshot=None, dependency_types=None):
+    """Return a persistent cache for results of tracing apt packages."""
+    name = 'apt:' + ','.join(targets) + ':' + \
+        dependency_types_key(dependency_types, DEFAULT_APT_DEPENDENCY_TYPES)
+    if snapshot is not None:
+        snapshot = os.path.abspath(snapshot)
+        return PersistentTracerCache(
+            name + ':' + snapshot, [snapshot], (APT_NODE,),
+            quiet=quiet)
+    return PersistentTracerCache(
+        name, get_apt_database_paths(), (APT_NODE,),
+        quiet=quiet)
+
+
+def create_apt_tracer(quiet=True, snapshot=None, dependency_types=None):
+    """Return an AptTracer using a snapshot file if given, else the apt cache."""
+    if snapshot is not None:
+        return AptTracer(
+            quiet=quiet, backend=AptSnapshot.load(snapshot),
+            dependency_types=dependency_types)
+    return AptTracer(quiet=quiet, dependency_types=dependency_types)
+
+
+# State of a worker process used by trace_targets_parallel
+_worker_tracer = None
+_worker_cache = None
+_worker_targets = None
+# Explored nodes the parent process already has results for
+_worker_exported = None
+
+
+def _explored_nodes(data):
+    return set(
+        Node(name, node_type) for name, node_type, targets_reached in data['nodes']
+        if targets_reached is not None)
+
+
+def _init_worker(targets, use_disk_cache, quiet, snapshot, dependency_types):
+    global _worker_tracer, _worker_cache, _worker_targets, _worker_exported
+    # Each worker opens the apt cache once and keeps it for every package
+    _worker_tracer = create_apt_tracer(
+        quiet=quiet, snapshot=snapshot, dependency_types=dependency_types)
+    if use_disk_cache:
+        _worker_cache = create_apt_disk_cache(
+            targets, quiet=quiet, snapshot=snapshot,
+            dependency_types=dependency_types).load()
+    else:
+        _worker_cache = TracerCache()
+    _worker_targets = targets
+    # The parent loads the same results from disk
+    _worker_exported = _explored_nodes(_worker_cache.export_data())
+
+
+def _trace_in_worker(starts):
+    results = []
+    for start in starts:
+        try:
+            verdicts = _worker_tracer.trace_verdicts(
+                start, _worker_targets, cache=_worker_cache)
+        except (KeyError, ValueError):
+            verdicts = None
+        results.append((start, verdicts))
+    # Only send what was learned since the last chunk
+    data = _worker_cache.export_data(exclude=_worker_exported)
+    _worker_exported.update(_explored_nodes(data))
+    return results, data
+
+
+def trace_targets_parallel(
+        starts, targets, jobs, use_disk_cache=True, quiet=True, snapshot=None,
+        dependency_types=None, cache=None):
+    """Trace many apt packages using a pool of worker processes.
+
+    Yields (start, {target: True if start depends on it}) for each start in
+    order, or (start, None) if it could not be traced.
+    No edges are collected, but they can be read from the cache afterwards.
+    Each worker keeps its own apt cache and TracerCache, so dependencies shared
+    by packages given to the same worker are only traced once.
+    If cache is given, results the workers learn are added to it as they
+    come back, so they can be saved by the caller.
+    """
+    starts = list(starts)
+    targets = list(targets)
+    # Hand out packages in contiguous chunks since neighbouring packages tend
+    # to share dependencies, but keep chunks small enough to balance the load
+    chunksize = max(1, len(starts) // (jobs * 8))
+    chunks = [starts[i:i + chunksize] for i in range(0, len(starts), chunksize)]
+    pool = multiprocessing.Pool(
+        jobs, initializer=_init_worker,
+        initargs=(targets, use_disk_cache, quiet, snapshot, dependency_types))
+    try:
+        for results, data in pool.imap(_trace_in_worker, chunks):
+            if cache is not None:
+                cache.import_data(data)
+            for result in results:
+                yield result
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
 
 
 APT_EDGE_LEGEND = {
@@ -142,45 +269,243 @@ APT_EDGE_LEGEND = {
 }
 
 
-class AptTracerCommand(object):
+def add_shortest_argument(parser):
+    parser.add_argument(
+        '--shortest', action='store_true',
+        help='only find the shortest chain of dependencies to each target, '
+             'which is much faster than finding every path')
+    parser.add_argument(
+        '--shortest-count', type=int, metavar='K',
+        help='find the K shortest chains instead of one, implies --shortest')
+
+
+def shortest_count(args):
+    """Return how many shortest chains to find, or None to find every path."""
+    if args.shortest_count is not None:
+        return args.shortest_count
+    if args.shortest:
+        return 1
+    return None
+
+
+def add_json_lines_argument(parser):
+    parser.add_argument(
+        '--jsonl', action='store_true',
+        help='output the dependency graph as one JSON object per edge')
+
+
+def add_fail_fast_argument(parser):
+    parser.add_argument(
+        '--fail-fast', action='store_true',
+        help='stop as soon as a dependency on any target is found, '
+             'only setting the exit code; much faster, but no paths are shown')
+
 
-    COMMAND_NAME='check-apt'
-    COMMAND_HELP='check if apt package depends on python 2'
+def print_shortest_paths(start, target, chains):
+    if chains:
+        print('{} depends on {}'.format(start, target))
+        for chain in chains:
+            print('    ' + format_path(chain))
+    else:
+        print('{} does not depend on {}'.format(start, target))
 
-    def __init__(self, parser):
+
+def add_apt_dependency_type_argument(parser):
+    parser.add_argument(
+        '--dependency-type', action='append', choices=APT_DEPENDENCY_TYPES,
+        help='only follow debian dependencies of this type, may be given more '
+             'than once (default Depends and PreDepends)')
+
+
+class AptTracerCommand(object):
+
+    def __init__(self, parser, resources=None):
+        if resources is None:
+            resources = Resources()
+        self._resources = resources
         # arguments for start, target, quiet, and dot output
         # Add arguments to arg-parser
         parser.add_argument(
-            'pkg', type=str,
+            'pkg', type=str, nargs='+',
             help='Name of package to check for dependency on python 2')
         parser.add_argument('--quiet', action='store_true')
         parser.add_argument(
             '--dot', action='store_true', help='output DOT graph')
+        add_json_lines_argument(parser)
         parser.add_argument(
-            '--target', default='python',
-            help='Package to trace to (default python)')
+            '--target', action='append',
+            help='Package to trace to, may be given more than once (default python)')
+        parser.add_argument(
+            '--no-cache', action='store_true',
+            help='do not read or write results cached by previous runs')
+        parser.add_argument(
+            '--jobs', type=int, default=1,
+            help='number of processes to check packages with (default 1)')
+        parser.add_argument(
+            '--snapshot', type=str,
+            help='read packages from a snapshot made by build-snapshot instead of apt')
+        add_apt_dependency_type_argument(parser)
+        add_shortest_argument(parser)
+        add_fail_fast_argument(parser)
 
     def do_command(self, args):
-        start = args.pkg
-        target = args.target
+        targets = args.target or ['python']
+        shortest = shortest_count(args)
+        if args.jobs < 1:
+            sys.stderr.write('--jobs must be at least 1\n')
+            return 2
+        if args.dot and args.jsonl:
+            sys.stderr.write('--dot can not be used with --jsonl\n')
+            return 2
+        graph = args.dot or args.jsonl
+        if args.fail_fast and (graph or shortest is not None):
+            sys.stderr.write(
+                '--fail-fast can not be used with --dot, --jsonl, or --shortest\n')
+            return 2
+        if shortest is not None and shortest < 1:
+            sys.stderr.write('--shortest-count must be at least 1\n')
+            return 2
+        if args.snapshot is None and apt_pkg is None:
+            please_install('apt_pkg', 'apt')
+        if args.snapshot is not None:
+            try:
+                # Fail early on a bad snapshot instead of in every worker
+                self._resources.apt_backend(args.snapshot)
+            except (IOError, OSError, ValueError, EOFError) as e:
+                sys.stderr.write(str(e) + '\n')
+                return 2
 
-        tracer = AptTracer(quiet=args.quiet)
+        if args.fail_fast:
+            return self._check_fail_fast(
+                args.pkg, targets, args.no_cache, args.quiet, args.snapshot,
+                args.dependency_type)
 
-        try:
-            paths = tracer.trace_paths(start, target)
-        except KeyError:
+        jobs = min(args.jobs, len(args.pkg))
+        disk_cache = None
+        if jobs > 1 and shortest is None:
+            if args.no_cache:
+                cache = TracerCache()
+            else:
+                disk_cache = self._resources.results_cache(create_apt_disk_cache(
+                    targets, quiet=args.quiet, snapshot=args.snapshot,
+                    dependency_types=args.dependency_type))
+                cache = disk_cache.load()
+            # Results learned by the workers are gathered in cache
+            results = trace_targets_parallel(
+                args.pkg, targets, jobs,
+                use_disk_cache=not args.no_cache, quiet=args.quiet,
+                snapshot=args.snapshot, dependency_types=args.dependency_type,
+                cache=cache)
+        else:
+            results, cache = self._trace_serial(
+                args.pkg, targets, args.no_cache, args.quiet, args.snapshot,
+                args.dependency_type, shortest)
+
+        # Edges of shortest chains aren't in the cache, so they're collected
+        collect = graph and shortest is not None
+        all_paths = set()
+        traced = []
+        failed = False
+        depends = False
+        for start, paths in results:
+            if paths is None:
+                failed = True
+                continue
+            traced.append(Node(start, APT_NODE))
+            if shortest is not None:
+                for target in targets:
+                    if collect:
+                        for chain in paths[target]:
+                            all_paths.update(chain)
+                    depends = depends or bool(paths[target])
+                    if not graph and not args.quiet:
+                        print_shortest_paths(start, target, paths[target])
+                continue
+            # paths are verdicts here, and edges are read from the cache
+            for target in targets:
+                if paths[target]:
+                    depends = True
+                    if not graph and not args.quiet:
+                        print('{} depends on {}'.format(start, target))
+                elif not graph and not args.quiet:
+                    print('{} does not depend on {}'.format(start, target))
+
+        if disk_cache is not None:
+            disk_cache.save(cache)
+
+        if failed:
             return 2
 
-        if args.dot:
-            print(paths_to_dot(paths, edge_legend=APT_EDGE_LEGEND))
-        elif not args.quiet:
-            if paths:
-                print('{} depends on {}'.format(start, target))
+        if graph:
+            if collect:
+                edges = all_paths
             else:
-                print('{} does not depend on {}'.format(start, target))
+                bits = cache.target_bits(targets)
+                edges = cache.edges_to_targets(
+                    traced, dict((Node(t, APT_NODE), bits[t]) for t in targets))
+            write_graph(
+                edges, sys.stdout, json_lines=args.jsonl, edge_legend=APT_EDGE_LEGEND)
 
-        if paths:
+        if depends:
             # non-zero exit code to indicate it does depend on target
             # because it's assumed depending on target is undesirable
             return 1
         return 0
+
+    def _create_tracer(self, quiet, snapshot, dependency_types):
+        return AptTracer(
+            quiet=quiet, backend=self._resources.apt_backend(snapshot),
+            dependency_types=dependency_types)
+
+    def _check_fail_fast(self, starts, targets, no_cache, quiet, snapshot, dependency_types):
+        tracer = self._create_tracer(quiet, snapshot, dependency_types)
+        cache = None
+        if not no_cache:
+            # Only used to skip what previous runs already traced
+            cache = self._resources.results_cache(create_apt_disk_cache(
+                targets, quiet=quiet, snapshot=snapshot,
+                dependency_types=dependency_types)).load()
+
+        for start in starts:
+            try:
+                depends = tracer.depends_on_any(start, targets, cache=cache)
+            except (KeyError, ValueError):
+                return 2
+            if depends:
+                if not quiet:
+                    print('{} depends on {}'.format(start, ' or '.join(targets)))
+                return 1
+            if not quiet:
+                print('{} does not depend on {}'.format(start, ' or '.join(targets)))
+        return 0
+
+    def _trace_serial(
+            self, starts, targets, no_cache, quiet, snapshot, dependency_types, shortest):
+        tracer = self._create_tracer(quiet, snapshot, dependency_types)
+
+        disk_cache = None
+        if no_cache:
+            cache = TracerCache()
+        else:
+            disk_cache = self._resources.results_cache(create_apt_disk_cache(
+                targets, quiet=quiet, snapshot=snapshot,
+                dependency_types=dependency_types))
+            cache = disk_cache.load()
+
+        results = []
+        for start in starts:
+            try:
+                if shortest is not None:
+                    paths = tracer.trace_shortest_targets(
+                        start, targets, k=shortest, cache=cache)
+                else:
+                    # Edges are read from the cache if they're needed
+                    paths = tracer.trace_verdicts(start, targets, cache=cache)
+            except (KeyError, ValueError):
+                paths = None
+            results.append((start, paths))
+
+        if disk_cache is not None:
+            # Nothing new is learned when finding shortest chains
+            disk_cache.save(cache)
+        return results, cache
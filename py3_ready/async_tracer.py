@@ -0,0 +1,108 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Trace dependencies from an asyncio event loop without blocking it.
+
+This needs python 3, but it's written without async/await so the package
+still byte-compiles on python 2.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from .dependency_tracer import TracerCache
+
+
+class AsyncTracer(object):
+    """Run a DependencyTracer in worker threads, returning asyncio futures.
+
+    Every trace shares one TracerCache, so a dependency shared by several
+    starts is only traced once.
+    Asking about a start that is already being traced returns a future for
+    the trace in progress instead of tracing it again.
+
+    Traces are run in a pool of max_workers threads sharing the tracer and
+    the cache, and the event loop stays free to do other work meanwhile.
+    Traces of different starts reaching the same dependencies at the same
+    time may both trace them, but they agree on the results.
+
+    Methods must be called from a coroutine or callback of a running event
+    loop, and the futures they return belong to that loop.
+    """
+
+    def __init__(self, tracer, targets, cache=None, max_workers=1):
+        self._tracer = tracer
+        self._targets = list(targets)
+        if cache is None:
+            cache = TracerCache()
+        self._cache = cache
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        # Key: (method name, start), Value: future of the call in progress
+        self._in_flight = {}
+
+    def _call(self, method, start):
+        key = (method, start)
+        future = self._in_flight.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().run_in_executor(
+                self._executor, getattr(self._tracer, method),
+                start, self._targets, self._cache)
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # Cancelling what one caller awaits mustn't cancel it for the others
+        return asyncio.shield(future)
+
+    def trace_targets(self, start):
+        """Return a future of {target: edges on paths from start to target}.
+
+        The future raises KeyError or ValueError if start can't be traced.
+        """
+        return self._call('trace_targets', start)
+
+    def depends_on_any(self, start):
+        """Return a future of True if start depends on any of the targets."""
+        return self._call('depends_on_any', start)
+
+    def trace_many(self, starts):
+        """Return a future of {start: {target: edges}} for many starts.
+
+        The value is None for starts that couldn't be traced.
+        """
+        starts = list(starts)
+        gathered = asyncio.gather(
+            *[self.trace_targets(start) for start in starts], return_exceptions=True)
+        result = asyncio.get_running_loop().create_future()
+
+        def done(gathered):
+            if result.cancelled():
+                return
+            if gathered.cancelled():
+                result.cancel()
+                return
+            results = {}
+            for start, paths in zip(starts, gathered.result()):
+                if isinstance(paths, (KeyError, ValueError)):
+                    paths = None
+                elif isinstance(paths, BaseException):
+                    result.set_exception(paths)
+                    return
+                results[start] = paths
+            result.set_result(results)
+
+        gathered.add_done_callback(done)
+        return result
+
+    def close(self):
+        """Wait for traces in progress to finish and stop the worker thread."""
+        self._executor.shutdown(wait=True)
@@ -14,6 +14,11 @@
 
 import sys
 import argparse
+import importlib
+import timeit
+
+from .stats import disable_stats
+from .stats import enable_stats
 
 
 def please_install(module, debian_package_suffix):
@@ -24,43 +29,94 @@ def please_install(module, debian_package_suffix):
             suffix=debian_package_suffix))
 
 
-def main():
+# Commands are listed here so they can be shown in the help without importing
+# them. Each is (name, help, module, class, modules it needs) where the needed
+# modules are given as (module, debian package suffix)
+COMMANDS = [
+    ('check-apt', 'check if apt package depends on python 2',
+        '.apt_tracer', 'AptTracerCommand', []),
+    ('build-snapshot', 'save Packages files to a snapshot that check-apt can read',
+        '.apt_snapshot', 'BuildSnapshotCommand', []),
+    ('check-rosdep', 'check if rosdep key depends on python 2',
+        '.rosdep', 'CheckRosdepCommand', [
+            ('apt_pkg', 'apt'),
+            ('rosdep2', 'rosdep-modules')]),
+    ('check-package', 'check if a ROS package depends on python 2',
+        '.package_xml', 'CheckPackageCommand', [
+            ('apt_pkg', 'apt'),
+            ('rosdep2', 'rosdep-modules'),
+            ('catkin_pkg', 'catkin-pkg-modules')]),
+    ('compare-rosdep', 'compare which rosdep keys depend on python 2 on several platforms',
+        '.compare', 'CompareRosdepCommand', [
+            ('rosdep2', 'rosdep-modules')]),
+    ('list-dependents', 'list apt packages, rosdep keys, and ROS packages depending on python 2',
+        '.reverse_index', 'ListDependentsCommand', [
+            ('apt', 'apt'),
+            ('rosdep2', 'rosdep-modules'),
+            ('catkin_pkg', 'catkin-pkg-modules')]),
+    ('serve', 'keep databases loaded and answer check commands sent with query',
+        '.server', 'ServeCommand', []),
+    ('query', 'run a check command in a running py3-ready serve',
+        '.client', 'QueryCommand', []),
+]
 
-    try:
-        import apt
-    except ImportError:
-        please_install('apt', 'apt')
-    from .apt_tracer import AptTracerCommand
 
-    try:
-        import rosdep2
-    except ImportError:
-        please_install('rosdep2', 'rosdep-modules')
-    from .rosdep import CheckRosdepCommand
+def load_command_class(module_name, class_name, requirements):
+    for module, debian_package_suffix in requirements:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            please_install(module, debian_package_suffix)
+    module = importlib.import_module(module_name, __package__)
+    return getattr(module, class_name)
+
 
+def add_stats_argument(parser):
+    parser.add_argument(
+        '--stats', action='store_true',
+        help='write counters and time spent in each phase to stderr')
+    parser.add_argument(
+        '--stats-format', choices=('text', 'json'),
+        help='write the stats as a summary (default) or JSON, implies --stats')
+
+
+def run_command(func, args, import_time=0.0):
+    """Run a command, writing stats to stderr if asked for, and return its exit code."""
+    if not args.stats and args.stats_format is None:
+        return func(args)
+    stats = enable_stats()
     try:
-        import catkin_pkg
-    except ImportError:
-        please_install('catkin_pkg', 'catkin-pkg-modules')
-    from .package_xml import CheckPackageCommand
+        stats.add_time('import', import_time)
+        with stats.phase('other'):
+            ret = func(args)
+        if args.stats_format == 'json':
+            stats.write_json(sys.stderr)
+        else:
+            stats.write_summary(sys.stderr)
+    finally:
+        disable_stats()
+    return ret
+
 
+def main():
     parser = argparse.ArgumentParser()
     subparsers = parser.add_subparsers()
 
-    cmd_classes = [
-        AptTracerCommand,
-        CheckRosdepCommand,
-        CheckPackageCommand
-    ]
-
-    for cmd_class in cmd_classes:
-        sub_parser = subparsers.add_parser(
-            cmd_class.COMMAND_NAME, help=cmd_class.COMMAND_HELP)
-        cmd = cmd_class(sub_parser)
-        sub_parser.set_defaults(func=cmd.do_command)
+    # Importing apt, rosdep2, and catkin_pkg is slow, so only the command
+    # being run is imported
+    import_time = 0.0
+    for name, help, module_name, class_name, requirements in COMMANDS:
+        sub_parser = subparsers.add_parser(name, help=help)
+        add_stats_argument(sub_parser)
+        if sys.argv[1:2] == [name]:
+            start = timeit.default_timer()
+            cmd_class = load_command_class(module_name, class_name, requirements)
+            import_time = timeit.default_timer() - start
+            cmd = cmd_class(sub_parser)
+            sub_parser.set_defaults(func=cmd.do_command)
 
     args = parser.parse_args()
     if not hasattr(args, 'func'):
         parser.print_usage()
     else:
-        sys.exit(args.func(args))
+        sys.exit(run_command(args.func, args, import_time))
@@ -0,0 +1,124 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Send check commands to a running `py3-ready serve`.
+
+Nothing slow to import is used here, so a query starts quickly.
+
+A query is one line of JSON sent over a Unix socket:
+{"argv": [...], "cwd": ..., "env": {...}}.
+The server answers with lines of JSON, each one of {"stdout": text},
+{"stderr": text}, or finally {"exit": code}.
+"""
+
+import argparse
+import json
+import os
+import socket
+import sys
+
+from .disk_cache import default_cache_dir
+
+# Commands the server answers
+SERVED_COMMANDS = ('check-apt', 'check-rosdep', 'check-package')
+
+# Environment variables changing what a command does, which are sent with
+# every query so the server runs it as if it was run by the client
+FORWARDED_ENV_VARS = (
+    'AMENT_PREFIX_PATH',
+    'CMAKE_PREFIX_PATH',
+    'COLCON_PREFIX_PATH',
+    'ROS_DISTRO',
+    'ROS_PYTHON_VERSION',
+    'ROS_OS_OVERRIDE',
+    'ROS_HOME',
+)
+
+
+def default_socket_path():
+    runtime_dir = os.getenv('XDG_RUNTIME_DIR')
+    if not runtime_dir:
+        runtime_dir = default_cache_dir()
+    return os.path.join(runtime_dir, 'py3-ready.sock')
+
+
+def add_socket_argument(parser):
+    parser.add_argument(
+        '--socket', type=str, default=None,
+        help='path of the server socket '
+             '(default $XDG_RUNTIME_DIR/py3-ready.sock, or ~/.cache/py3-ready/py3-ready.sock)')
+
+
+def send_message(fout, message):
+    fout.write((json.dumps(message) + '\n').encode('utf-8'))
+    fout.flush()
+
+
+def read_message(fin):
+    """Return the next message, or None if the other end closed the connection."""
+    line = fin.readline()
+    if not line:
+        return None
+    return json.loads(line.decode('utf-8'))
+
+
+def query(socket_path, argv):
+    """Run a command in the server, forwarding its output, and return its exit code.
+
+    Raises socket.error if the server can't be reached.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        fout = sock.makefile('wb')
+        fin = sock.makefile('rb')
+        send_message(fout, {
+            'argv': argv,
+            'cwd': os.getcwd(),
+            'env': dict((var, os.getenv(var)) for var in FORWARDED_ENV_VARS),
+        })
+        while True:
+            message = read_message(fin)
+            if message is None:
+                sys.stderr.write('py3-ready serve stopped before the command finished\n')
+                return 2
+            if 'stdout' in message:
+                sys.stdout.write(message['stdout'])
+            elif 'stderr' in message:
+                sys.stderr.write(message['stderr'])
+            elif 'exit' in message:
+                return message['exit']
+    finally:
+        sock.close()
+
+
+class QueryCommand(object):
+
+    def __init__(self, parser):
+        add_socket_argument(parser)
+        parser.add_argument(
+            'command', choices=SERVED_COMMANDS,
+            help='command for the server to run')
+        parser.add_argument(
+            'arguments', nargs=argparse.REMAINDER,
+            help='arguments of the command')
+
+    def do_command(self, args):
+        socket_path = args.socket or default_socket_path()
+        try:
+            return query(socket_path, [args.command] + args.arguments)
+        except socket.error as e:
+            sys.stderr.write(
+                'Could not reach py3-ready serve at {}: {}\n'.format(socket_path, e))
+            return 2
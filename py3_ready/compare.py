@@ -0,0 +1,163 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tools for comparing rosdep keys across distros."""
+
+from __future__ import print_function
+
+import sys
+
+from .apt_snapshot import AptSnapshot
+from .dependency_tracer import TracerCache
+from .rosdep import create_rosdep_disk_cache
+from .rosdep import is_rosdep_initialized
+from .rosdep import RosdepResolver
+from .rosdep import RosdepTracer
+
+
+def compare_rosdep_keys(keys, platforms, targets, resolver, use_disk_cache=True, quiet=True):
+    """Trace rosdep keys on several platforms.
+
+    platforms is a list of (snapshot path, os_name, os_version).
+    The rosdep database is loaded once by the resolver, and each platform
+    only changes the OS keys are resolved for and the apt snapshot.
+
+    Returns {key: [verdict for each platform]} where a verdict is a list of
+    targets the key depends on, or None if it could not be traced.
+    """
+    verdicts = dict((key, []) for key in keys)
+    for snapshot, os_name, os_version in platforms:
+        tracer = RosdepTracer(
+            quiet=quiet,
+            resolver=resolver.for_os(os_name, os_version),
+            apt_backend=AptSnapshot.load(snapshot))
+
+        # One cache per platform shared by all keys
+        disk_cache = None
+        if use_disk_cache:
+            disk_cache = create_rosdep_disk_cache(
+                targets, quiet=quiet, snapshot=snapshot,
+                os_override=(os_name, os_version))
+            cache = disk_cache.load()
+        else:
+            cache = TracerCache()
+
+        for key in keys:
+            try:
+                paths = tracer.trace_targets(key, targets, cache=cache)
+            except (KeyError, ValueError):
+                verdicts[key].append(None)
+                continue
+            verdicts[key].append([target for target in targets if paths[target]])
+
+        if disk_cache is not None:
+            disk_cache.save(cache)
+    return verdicts
+
+
+def print_comparison_table(keys, labels, verdicts):
+    """Print a row per key with a column saying what it depends on per platform."""
+    rows = [['key'] + list(labels)]
+    for key in keys:
+        row = [key]
+        for verdict in verdicts[key]:
+            if verdict is None:
+                row.append('unavailable')
+            elif verdict:
+                row.append(', '.join(verdict))
+            else:
+                row.append('-')
+        rows.append(row)
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    for row in rows:
+        print('  '.join(
+            cell.ljust(width) for cell, width in zip(row, widths)).rstrip())
+
+
+class CompareRosdepCommand(object):
+
+    def __init__(self, parser):
+        parser.add_argument(
+            'key', type=str, nargs='*',
+            help='rosdep key to compare')
+        parser.add_argument(
+            '--all', action='store_true',
+            help='compare every key in the rosdep database')
+        parser.add_argument(
+            '--platform', nargs=2, action='append', required=True,
+            metavar=('SNAPSHOT', 'OS_NAME:OS_VERSION'),
+            help='apt snapshot made by build-snapshot and the OS to resolve keys '
+                 'for, given once per platform to compare')
+        parser.add_argument('--quiet', action='store_true')
+        parser.add_argument(
+            '--target', action='append',
+            help='Debian package to trace to, may be given more than once (default python)')
+        parser.add_argument(
+            '--show-same', action='store_true',
+            help='also show keys that are the same on every platform')
+        parser.add_argument(
+            '--no-cache', action='store_true',
+            help='do not read or write results cached by previous runs')
+
+    def do_command(self, args):
+        if not args.key and not args.all:
+            sys.stderr.write('Expected a rosdep key or --all\n')
+            return 2
+        targets = args.target or ['python']
+
+        platforms = []
+        for snapshot, os_override in args.platform:
+            os_name, _, os_version = os_override.partition(':')
+            if not os_name or not os_version:
+                sys.stderr.write(
+                    "Expected OS_NAME:OS_VERSION but got '{}'\n".format(os_override))
+                return 2
+            platforms.append((snapshot, os_name, os_version))
+
+        if not is_rosdep_initialized():
+            sys.stderr.write(
+                'The rosdep database is not ready to be used. '
+                'Run \n\n\trosdep update\n\n')
+            return 2
+
+        resolver = RosdepResolver(quiet=args.quiet)
+        keys = list(args.key)
+        if args.all:
+            keys.extend(sorted(key for key in resolver.keys() if key not in keys))
+
+        try:
+            verdicts = compare_rosdep_keys(
+                keys, platforms, targets, resolver,
+                use_disk_cache=not args.no_cache, quiet=args.quiet)
+        except (IOError, OSError, ValueError, EOFError) as e:
+            # Bad snapshot
+            sys.stderr.write(str(e) + '\n')
+            return 2
+        except KeyError as e:
+            sys.stderr.write('Unknown OS {}\n'.format(e))
+            return 2
+
+        different = [
+            key for key in keys
+            if any(verdict != verdicts[key][0] for verdict in verdicts[key])]
+        if not args.quiet:
+            shown = keys if args.show_same else different
+            if shown:
+                print_comparison_table(
+                    shown, [os_version for _, _, os_version in platforms], verdicts)
+
+        if different:
+            # non-zero exit code to indicate the platforms differ
+            return 1
+        return 0
@@ -14,10 +14,66 @@
 
 """Interface for tracing package dependencies."""
 
+from array import array
+from collections import deque
+import threading
+
+from .stats import current_stats
+
 
 class DependencyTracer(object):
 
-    def trace_paths(self, start, target):
+    def trace_paths(self, start, target, cache=None):
+        return self.trace_targets(start, [target], cache=cache)[target]
+
+    def trace_targets(self, start, targets, cache=None):
+        """Return {target: edges on paths from start to target} for each target."""
+        raise NotImplementedError()
+
+    def trace_verdicts(self, start, targets, cache=None):
+        """Return {target: True if start depends on it} for each target.
+
+        Start is traced into the cache like trace_targets(), but no edges
+        are collected, which is much faster for big packages.
+        """
+        if not cache:
+            cache = TracerCache()
+        start_node, bits, target_mask = self.trace_into_cache(start, targets, cache)
+        # Like trace_targets(), a target doesn't depend on itself
+        targets_reached = cache.check_targets_reached(start_node) & ~target_mask(start_node)
+        return dict(
+            (target, bool(targets_reached & bit)) for target, bit in bits.items())
+
+    def trace_into_cache(self, start, targets, cache):
+        """Trace start unless the cache already has it.
+
+        Returns the node of start, {target: bit} of the cache, and a callable
+        giving the target bits of a node.
+        """
+        raise NotImplementedError()
+
+    def trace_shortest_paths(self, start, target, k=1, cache=None):
+        """Return up to k shortest chains of edges from start to target.
+
+        The cache is only used to skip nodes known to not lead to target.
+        """
+        raise NotImplementedError()
+
+    def depends_on_any(self, start, targets, cache=None):
+        """Return True as soon as start is found to lead to any of the targets.
+
+        No edges are collected, and the cache is only read.
+        """
+        raise NotImplementedError()
+
+    def trace_shortest_targets(self, start, targets, k=1, cache=None):
+        """Return {target: up to k shortest chains from start to target}."""
+        return {
+            target: self.trace_shortest_paths(start, target, k=k, cache=cache)
+            for target in targets}
+
+    def successors(self, node):
+        """Yield (edge_type, node) pairs for each dependency of a node."""
         raise NotImplementedError()
 
 
@@ -25,24 +81,31 @@ class Node(object):
 
     __slots__ = (
         'name',
-        'node_type'
+        'node_type',
+        '_hash',
     )
 
     def __init__(self, name, node_type):
         self.name = name
         self.node_type = node_type
+        # Nodes are hashed a lot while tracing, so only compute it once
+        self._hash = hash((name, node_type))
 
     def __key(self):
         return (self.name, self.node_type)
 
     def __hash__(self):
-        return hash(self.__key())
+        return self._hash
 
     def __eq__(self, other):
         if isinstance(other, Node):
             return self.__key() == other.__key()
         return NotImplemented
 
+    def __reduce__(self):
+        # Recompute the hash when unpickled since it may differ between processes
+        return (Node, (self.name, self.node_type))
+
 
 class Edge(object):
 
@@ -69,53 +132,668 @@ class Edge(object):
         return NotImplemented
 
 
+# States of a node in a TracerCache
+_UNVISITED = 0
+_VISITED = 1
+_EXPLORED = 2
+
+# Number of low bits of a packed edge holding the edge type code
+_EDGE_TYPE_BITS = 8
+_EDGE_TYPE_MASK = (1 << _EDGE_TYPE_BITS) - 1
+
+# Which targets a node leads to is stored as a bitmask in an unsigned long
+MAX_TARGETS = 8 * array('L').itemsize
+
+
 class TracerCache(object):
-    """Caches edges and dead ends to target."""
+    """Caches edges and dead ends to targets.
+
+    Nodes are interned as integer ids.
+    Edges are stored as arrays of integers per start node, each holding the
+    id of the end node and a small code for the edge type.
+    Node and Edge objects are only created when edges are read back out.
+
+    A cache can trace to several targets at once.
+    Each target is given one bit, and every explored node stores a bitmask of
+    the targets it leads to.
+    The targets are fixed the first time the cache is used.
+
+    A cache may be shared by tracers in several threads.
+    Changes are made while holding lock, and trace() holds it while writing
+    a finished component, so other threads never see part of one.
+    Reading a single node's verdict or edges doesn't need the lock.
+    """
 
     def __init__(self):
-        # Key is (name, rawtype) value is True/False if node leads to target
-        self._visited_nodes = {}  # type: Dict[(str, str), Optional[bool]]
-        self._edges = {}  # type: Dict[(str, str), Set[(str, str)]]
+        self.lock = threading.RLock()
+        # Names of targets; index is the bit used for the target
+        self.targets = None  # type: Optional[Tuple[str, ...]]
+        # Key is a Node, value is its id
+        self._node_ids = {}  # type: Dict[Node, int]
+        # Indexed by node id
+        self._nodes = []  # type: List[Node]
+        self._states = bytearray()
+        self._target_masks = array('L')
+        self._edges = []  # type: List[Optional[array.array]]
+        # Index is an edge type code
+        self._edge_types = []  # type: List[str]
+        self._edge_type_codes = {}  # type: Dict[str, int]
+
+    def target_bits(self, targets):
+        """Return {target: bit mask} for the given targets.
+
+        The first call decides which targets the cache traces to.
+        Later calls may use any subset of them.
+        """
+        with self.lock:
+            if self.targets is None:
+                targets = tuple(targets)
+                if len(targets) > MAX_TARGETS:
+                    raise ValueError(
+                        'Can trace to at most {} targets at once'.format(MAX_TARGETS))
+                if len(set(targets)) != len(targets):
+                    raise ValueError('Duplicate targets: {}'.format(targets))
+                self.targets = targets
+        bits = {}
+        for target in targets:
+            if target not in self.targets:
+                raise ValueError(
+                    "Cache traces to {}, not '{}'".format(self.targets, target))
+            bits[target] = 1 << self.targets.index(target)
+        return bits
+
+    def all_targets_mask(self):
+        if self.targets is None:
+            return 1
+        return (1 << len(self.targets)) - 1
+
+    def _node_id(self, node):
+        """Return the id of a node, interning it if it wasn't seen before.
+
+        The lock must be held.
+        """
+        node_id = self._node_ids.get(node)
+        if node_id is None:
+            node_id = len(self._nodes)
+            self._nodes.append(node)
+            self._states.append(_UNVISITED)
+            self._target_masks.append(0)
+            self._edges.append(None)
+            # Added last since readers not holding the lock look up the id
+            # first, and then index the lists with it
+            self._node_ids[node] = node_id
+        return node_id
+
+    def _state(self, node):
+        node_id = self._node_ids.get(node)
+        if node_id is None:
+            return _UNVISITED
+        return self._states[node_id]
+
+    def _edge_type_code(self, edge_type):
+        code = self._edge_type_codes.get(edge_type)
+        if code is None:
+            code = len(self._edge_types)
+            if code > _EDGE_TYPE_MASK:
+                raise ValueError('Too many edge types')
+            self._edge_type_codes[edge_type] = code
+            self._edge_types.append(edge_type)
+        return code
 
     def visit(self, node):
-        if node not in self._visited_nodes:
-            self._visited_nodes[node] = None
+        with self.lock:
+            node_id = self._node_id(node)
+            if self._states[node_id] == _UNVISITED:
+                self._states[node_id] = _VISITED
 
     def check_visited(self, node):
-        if node in self._visited_nodes:
+        if self._state(node) != _UNVISITED:
             return True
 
     def check_leads_to_target(self, node):
-        if node in self._visited_nodes:
-            return self._visited_nodes[node]
+        targets_reached = self.check_targets_reached(node)
+        if targets_reached is not None:
+            return bool(targets_reached)
+
+    def check_targets_reached(self, node):
+        """Return a bitmask of targets a node leads to, or None if not explored."""
+        node_id = self._node_ids.get(node)
+        if node_id is not None and self._states[node_id] == _EXPLORED:
+            return self._target_masks[node_id]
 
     def check_fully_explored(self, node):
-        if node in self._visited_nodes:
-            return self._visited_nodes[node] is not None
-        return False
+        return self._state(node) == _EXPLORED
+
+    def _edges_from_id(self, node_id, target_mask=None):
+        packed_edges = self._edges[node_id]
+        if packed_edges is None:
+            return
+        start = self._nodes[node_id]
+        for packed in packed_edges:
+            end_id = packed >> _EDGE_TYPE_BITS
+            if target_mask is None or self._target_masks[end_id] & target_mask:
+                yield Edge(
+                    start,
+                    self._edge_types[packed & _EDGE_TYPE_MASK],
+                    self._nodes[end_id])
 
     def edges(self, node):
-        if node in self._edges:
-            for edge in self._edges[node]:
+        node_id = self._node_ids.get(node)
+        if node_id is not None:
+            for edge in self._edges_from_id(node_id):
+                yield edge
+
+    def recursive_edges(self, node, target_mask=None, stop_at=None):
+        """Yield every edge reachable from a node.
+
+        If target_mask is given then only edges leading to one of those
+        targets are followed.
+        Edges out of the node stop_at are not followed.
+        Other threads can't change the cache until every edge was yielded.
+        """
+        with self.lock:
+            for edge in self._recursive_edges(node, target_mask, stop_at):
+                yield edge
+
+    def _recursive_edges(self, node, target_mask, stop_at):
+        node_id = self._node_ids.get(node)
+        if node_id is None:
+            return
+        # Every edge of every reachable node is yielded exactly once
+        reached = bytearray(len(self._nodes))
+        reached[node_id] = 1
+        stack = [node_id]
+        if stop_at is not None:
+            stop_id = self._node_ids.get(stop_at)
+            if stop_id is not None:
+                if stop_id == node_id:
+                    return
+                reached[stop_id] = 1
+        while stack:
+            node_id = stack.pop()
+            packed_edges = self._edges[node_id]
+            if packed_edges is None:
+                continue
+            for packed in packed_edges:
+                end_id = packed >> _EDGE_TYPE_BITS
+                if target_mask is not None and not self._target_masks[end_id] & target_mask:
+                    continue
+                if not reached[end_id]:
+                    reached[end_id] = 1
+                    stack.append(end_id)
+            for edge in self._edges_from_id(node_id, target_mask):
                 yield edge
 
-    def recursive_edges(self, node):
+    def edges_to_targets(self, starts, target_nodes):
+        """Yield every edge on a path from any of the starts to a target once.
 
-        def _recursive_edges(node, edges):
-            for edge in self.edges(node):
-                if edge not in edges:
-                    edges.add(edge)
-                    _recursive_edges(edge.end, edges)
+        target_nodes is {node: bit of the target it is}.
+        This gives the same edges as the union of paths_to_targets() for each
+        start, without keeping them all in memory to remove duplicates.
+        Edges out of a target are only followed for other targets.
+        Other threads can't change the cache until every edge was yielded.
+        """
+        with self.lock:
+            for edge in self._edges_to_targets(starts, target_nodes):
+                yield edge
 
-        edges = set()
-        _recursive_edges(node, edges)
-        for edge in edges:
-            yield edge
+    def _edges_to_targets(self, starts, target_nodes):
+        own_bits = {}
+        all_targets = 0
+        for node, bit in target_nodes.items():
+            all_targets |= bit
+            node_id = self._node_ids.get(node)
+            if node_id is not None:
+                own_bits[node_id] = bit
+        # Per node, targets it's on a path to, and targets its edges were followed for
+        reached = array('L', [0]) * len(self._nodes)
+        followed = array('L', [0]) * len(self._nodes)
+        stack = []
+        for start in starts:
+            node_id = self._node_ids.get(start)
+            if node_id is not None and all_targets & ~reached[node_id]:
+                reached[node_id] |= all_targets
+                stack.append(node_id)
+        while stack:
+            node_id = stack.pop()
+            now = reached[node_id]
+            before = followed[node_id]
+            if now == before:
+                continue
+            followed[node_id] = now
+            packed_edges = self._edges[node_id]
+            if packed_edges is None:
+                continue
+            not_own = ~own_bits.get(node_id, 0)
+            for packed in packed_edges:
+                end_id = packed >> _EDGE_TYPE_BITS
+                end_mask = self._target_masks[end_id] & not_own
+                if not now & end_mask:
+                    continue
+                if not before & end_mask:
+                    # First time this edge is on a path to any target
+                    yield Edge(
+                        self._nodes[node_id],
+                        self._edge_types[packed & _EDGE_TYPE_MASK],
+                        self._nodes[end_id])
+                if now & end_mask & ~reached[end_id]:
+                    reached[end_id] |= now & end_mask
+                    stack.append(end_id)
 
     def add_edge(self, edge):
-        if edge.start not in self._edges:
-            self._edges[edge.start] = set()
-        self._edges[edge.start].add(edge)
+        self.add_edge_between(edge.start, edge.edge_type, edge.end)
+
+    def add_edge_between(self, start, edge_type, end):
+        """Same as add_edge(), but without needing an Edge instance."""
+        with self.lock:
+            self._add_edge_between(start, edge_type, end)
+
+    def _add_edge_between(self, start, edge_type, end):
+        # The lock must be held
+        start_id = self._node_id(start)
+        packed = self._node_id(end) << _EDGE_TYPE_BITS | self._edge_type_code(edge_type)
+        packed_edges = self._edges[start_id]
+        if packed_edges is None:
+            self._edges[start_id] = array('l', (packed,))
+        elif packed not in packed_edges:
+            packed_edges.append(packed)
 
     def mark_leads_to_target(self, node, gets_there):
-        self._visited_nodes[node] = gets_there
+        if gets_there:
+            self.mark_targets_reached(node, self.all_targets_mask())
+        else:
+            self.mark_targets_reached(node, 0)
+
+    def mark_targets_reached(self, node, target_mask):
+        with self.lock:
+            self._mark_targets_reached(node, target_mask)
+
+    def _mark_targets_reached(self, node, target_mask):
+        # The lock must be held
+        node_id = self._node_id(node)
+        self._target_masks[node_id] = target_mask
+        self._states[node_id] = _EXPLORED
+
+    def forget(self, nodes):
+        """Forget what is known about nodes so they are traced again.
+
+        Nothing else is changed, so every node leading to them must be
+        forgotten too.
+        """
+        with self.lock:
+            for node in nodes:
+                node_id = self._node_ids.get(node)
+                if node_id is not None:
+                    self._states[node_id] = _UNVISITED
+                    self._target_masks[node_id] = 0
+                    self._edges[node_id] = None
+
+    def num_explored(self):
+        # python 2's bytearray.count() only takes a buffer, not an int
+        return self._states.count(bytearray((_EXPLORED,)))
+
+    def export_data(self, node_types=None, exclude=None):
+        """Return fully explored nodes and their edges as plain data.
+
+        Nodes in exclude are left out, unless an edge of another node ends there.
+        """
+        with self.lock:
+            return self._export_data(node_types, exclude)
+
+    def _export_data(self, node_types, exclude):
+        indices = {}
+        nodes = []
+
+        def index(node_id):
+            if node_id not in indices:
+                indices[node_id] = len(nodes)
+                node = self._nodes[node_id]
+                nodes.append((node.name, node.node_type, self.check_targets_reached(node)))
+            return indices[node_id]
+
+        explored = []
+        for node_id, node in enumerate(self._nodes):
+            if self._states[node_id] != _EXPLORED:
+                continue
+            if node_types is not None and node.node_type not in node_types:
+                continue
+            if exclude is not None and node in exclude:
+                continue
+            index(node_id)
+            explored.append(node_id)
+        edges = []
+        for start_id in explored:
+            packed_edges = self._edges[start_id]
+            if packed_edges is None:
+                continue
+            for packed in packed_edges:
+                # Edge ends may not be explored nodes themselves
+                end = index(packed >> _EDGE_TYPE_BITS)
+                edges.append((
+                    indices[start_id], self._edge_types[packed & _EDGE_TYPE_MASK], end))
+        return {'targets': self.targets, 'nodes': nodes, 'edges': edges}
+
+    def import_data(self, data):
+        """Add results previously returned by export_data()."""
+        with self.lock:
+            self._import_data(data)
+
+    def _import_data(self, data):
+        if data['targets'] is not None:
+            if self.targets is None:
+                self.target_bits(data['targets'])
+            elif tuple(data['targets']) != self.targets:
+                raise ValueError(
+                    'Cache traces to {}, not {}'.format(self.targets, data['targets']))
+        nodes = [Node(name, node_type) for name, node_type, _ in data['nodes']]
+        for node, (_, _, targets_reached) in zip(nodes, data['nodes']):
+            self._node_id(node)
+            if targets_reached is not None:
+                self._mark_targets_reached(node, targets_reached)
+        for start, edge_type, end in data['edges']:
+            self._add_edge_between(nodes[start], edge_type, nodes[end])
+
+
+def trace(start, target_mask, successors, cache):
+    """Depth first search marking in the cache which targets each node leads to.
+
+    Circular dependencies are handled with Tarjan's strongly connected
+    components algorithm.
+    Every node in a cycle can reach every other node in it, so the whole
+    cycle is given one verdict when the last of its nodes is explored.
+    This makes results independent of the order dependencies are visited in.
+    An explicit stack is used instead of recursion so arbitrarily deep
+    dependency graphs can be traced.
+
+    An edge is added to the cache for every dependency that leads to a target.
+    Only finished components are written to the cache, so it is left
+    unchanged if successors() raises.
+
+    :param start: node to start tracing from
+    :param target_mask: callable returning the bits of the targets a node is
+    :param successors: callable yielding (edge_type, node) pairs for a node
+    :param cache: TracerCache to store results in
+    :returns: bitmask of the targets start leads to
+    """
+    stats = current_stats()
+    if cache.check_fully_explored(start):
+        stats.count('result cache hits')
+        return cache.check_targets_reached(start)
+    with stats.phase('trace'):
+        return _trace(start, target_mask, successors, cache, stats)
+
+
+def _trace(start, target_mask, successors, cache, stats):
+    all_targets = cache.all_targets_mask()
+    # Counted locally since incrementing stats for every edge is slow
+    traced = 1
+    cache_hits = 0
+    cycles = 0
+
+    # Bookkeeping for nodes in components that aren't finished yet
+    index = {}
+    lowlink = {}
+    targets_reached = {}
+    # Edges between nodes in the same component, added only if it leads to target
+    internal_edges = {}
+    # Edges to finished nodes leading to a target, added with the component
+    external_edges = {}
+    component_stack = []
+
+    # Each frame is [node, iterator over successors, edge type to child being explored]
+    call_stack = []
+
+    def push(node):
+        # Finished components are always popped off the top of the component
+        # stack, so len(index) is never an index that is still in use
+        index[node] = len(index)
+        lowlink[node] = index[node]
+        targets_reached[node] = target_mask(node)
+        internal_edges[node] = []
+        external_edges[node] = []
+        component_stack.append(node)
+        if targets_reached[node] == all_targets:
+            # A target's own dependencies only matter for other targets
+            call_stack.append([node, iter(()), None])
+        else:
+            call_stack.append([node, iter(successors(node)), None])
+
+    push(start)
+    while call_stack:
+        frame = call_stack[-1]
+        node = frame[0]
+        descend = None
+        for edge_type, child in frame[1]:
+            if cache.check_fully_explored(child):
+                cache_hits += 1
+                child_reached = cache.check_targets_reached(child)
+                if child_reached:
+                    external_edges[node].append((edge_type, child))
+                    targets_reached[node] |= child_reached
+            elif child in index:
+                # Circular dependency on a node in an unfinished component
+                lowlink[node] = min(lowlink[node], index[child])
+                internal_edges[node].append((edge_type, child))
+            else:
+                descend = child
+                frame[2] = edge_type
+                break
+        if descend is not None:
+            traced += 1
+            push(descend)
+            continue
+
+        # All dependencies of this node have been explored
+        call_stack.pop()
+        if lowlink[node] == index[node]:
+            # node is the root of a component; pop the whole thing
+            component = []
+            while True:
+                member = component_stack.pop()
+                component.append(member)
+                if member == node:
+                    break
+            if len(component) > 1:
+                cycles += 1
+            component_reached = 0
+            for member in component:
+                component_reached |= targets_reached[member]
+            # Other threads see the whole component finished at once
+            with cache.lock:
+                for member in component:
+                    for edge_type, end in external_edges[member]:
+                        cache._add_edge_between(member, edge_type, end)
+                    if component_reached:
+                        for edge_type, end in internal_edges[member]:
+                            cache._add_edge_between(member, edge_type, end)
+                    # Edges are added before the verdict so anything that sees a
+                    # node leading to target also sees all of its edges
+                    cache._mark_targets_reached(member, component_reached)
+            for member in component:
+                del index[member]
+                del lowlink[member]
+                del targets_reached[member]
+                del internal_edges[member]
+                del external_edges[member]
+
+        if call_stack:
+            parent = call_stack[-1]
+            parent_node = parent[0]
+            if cache.check_fully_explored(node):
+                node_reached = cache.check_targets_reached(node)
+                if node_reached:
+                    external_edges[parent_node].append((parent[2], node))
+                    targets_reached[parent_node] |= node_reached
+            else:
+                # node is in the same component as its parent
+                lowlink[parent_node] = min(lowlink[parent_node], lowlink[node])
+                internal_edges[parent_node].append((parent[2], node))
+    stats.count('nodes visited', traced + cache_hits)
+    stats.count('result cache misses', traced)
+    stats.count('result cache hits', cache_hits)
+    stats.count('cycles', cycles)
+    return cache.check_targets_reached(start)
+
+
+def paths_to_targets(start, target_bits, node_type, cache):
+    """Return {target: edges on paths from start to target} from a traced cache."""
+    with current_stats().phase('collect paths'):
+        return {
+            target: list(cache.recursive_edges(
+                start, target_mask=mask, stop_at=Node(target, node_type)))
+            for target, mask in target_bits.items()}
+
+
+def cached_verdicts(cache, targets):
+    """Return a callable saying if a traced cache knows a node reaches any target.
+
+    The callable returns True or False, or None if the node wasn't explored.
+    Returns None if the cache doesn't trace to all of the targets.
+    """
+    if cache is None or cache.targets is None or \
+            any(target not in cache.targets for target in targets):
+        return None
+    mask = 0
+    for bit in cache.target_bits(targets).values():
+        mask |= bit
+
+    def verdict(node):
+        targets_reached = cache.check_targets_reached(node)
+        if targets_reached is not None:
+            return bool(targets_reached & mask)
+    return verdict
+
+
+def known_dead_ends(cache, target):
+    """Return a callable saying if a traced cache knows a node can't reach target."""
+    verdict = cached_verdicts(cache, [target])
+    if verdict is None:
+        return None
+    return lambda node: verdict(node) is False
+
+
+def reaches_target(start, target_mask, successors, verdict=None):
+    """Depth first search returning True as soon as any target is found.
+
+    Unlike trace() nothing is written to a cache and no edges are kept, so
+    the search can stop at the first target instead of exploring every
+    dependency to collect all paths.
+
+    :param start: node to start from
+    :param target_mask: callable returning non-zero if a node is a target
+    :param successors: callable yielding (edge_type, node) pairs for a node
+    :param verdict: optional callable returning True or False for nodes
+        already known to lead to a target or not, and None otherwise
+    """
+    visited = set([start])
+    try:
+        with current_stats().phase('search'):
+            return _reaches_target(start, target_mask, successors, verdict, visited)
+    finally:
+        current_stats().count('nodes visited', len(visited))
+
+
+def _reaches_target(start, target_mask, successors, verdict, visited):
+    stack = [iter(successors(start))]
+    while stack:
+        for _, child in stack[-1]:
+            if child in visited:
+                continue
+            visited.add(child)
+            if target_mask(child):
+                return True
+            known = verdict(child) if verdict is not None else None
+            if known is True:
+                return True
+            if known is None:
+                stack.append(iter(successors(child)))
+                break
+        else:
+            stack.pop()
+    return False
+
+
+def shortest_paths(start, target_mask, successors, k=1, is_dead_end=None):
+    """Breadth first search for the k shortest chains of edges from start to a target.
+
+    Unlike trace() this stops as soon as k chains are found, so only the part
+    of the graph closer to start than the k-th chain is explored.
+    Chains never pass through a node twice, and several edges between the
+    same two nodes only count once.
+    Each node is expanded at most k times, since the k shortest chains can't
+    need more than k ways of getting to any node.
+
+    :param start: node to start from
+    :param target_mask: callable returning non-zero if a node is a target
+    :param successors: callable yielding (edge_type, node) pairs for a node
+    :param k: number of chains to find
+    :param is_dead_end: optional callable returning True for nodes known to
+        not lead to a target, which are skipped
+    :returns: list of chains shortest first, each a list of Edge
+    """
+    with current_stats().phase('search'):
+        return _shortest_paths(start, target_mask, successors, k, is_dead_end)
+
+
+def _chain_to(entry):
+    edges = []
+    while entry[2] is not None:
+        edges.append(Edge(entry[2][0], entry[1], entry[0]))
+        entry = entry[2]
+    edges.reverse()
+    return edges
+
+
+def _on_chain(entry, node):
+    while entry is not None:
+        if entry[0] == node:
+            return True
+        entry = entry[2]
+    return False
+
+
+def _shortest_paths(start, target_mask, successors, k, is_dead_end):
+    found = []
+    # Key: node, Value: number of times it was expanded
+    expanded = {}
+    # Each entry is (node, type of edge into it, entry of the previous node)
+    queue = deque([(start, None, None)])
+    while queue and len(found) < k:
+        entry = queue.popleft()
+        node = entry[0]
+        times = expanded.get(node, 0)
+        if times >= k:
+            continue
+        expanded[node] = times + 1
+        children = set()
+        for edge_type, child in successors(node):
+            if child in children:
+                continue
+            children.add(child)
+            child_times = expanded.get(child, 0)
+            # Every node on a chain was expanded, so only those need to be
+            # looked for on the chain
+            if child_times >= k or (child_times and _on_chain(entry, child)):
+                continue
+            if is_dead_end is not None and is_dead_end(child):
+                continue
+            child_entry = (child, edge_type, entry)
+            if target_mask(child):
+                # Breadth first, so no later chain is shorter than this one
+                found.append(_chain_to(child_entry))
+                if len(found) == k:
+                    break
+            else:
+                queue.append(child_entry)
+    current_stats().count('nodes visited', sum(expanded.values()))
+    return found
+
+
+def format_path(edges):
+    """Return a chain of edges as one line of text."""
+    if not edges:
+        return ''
+    parts = [edges[0].start.name]
+    for edge in edges:
+        parts.append('-{}-> {}'.format(edge.edge_type, edge.end.name))
+    return ' '.join(parts)
@@ -0,0 +1,142 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Persist tracer results between runs."""
+
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+
+from .dependency_tracer import TracerCache
+from .stats import current_stats
+
+# Bump when the layout of the cache file changes
+CACHE_FORMAT_VERSION = 2
+
+
+def default_cache_dir():
+    cache_home = os.getenv('XDG_CACHE_HOME')
+    if not cache_home:
+        cache_home = os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'py3-ready')
+
+
+def fingerprint_paths(paths):
+    """Return a hash that changes when any of the given files change."""
+    digest = hashlib.sha1()
+
+    def add_stat(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            digest.update('{}:missing\n'.format(path).encode('utf-8'))
+            return
+        digest.update('{}:{}:{}\n'.format(
+            path, st.st_size, st.st_mtime).encode('utf-8'))
+
+    for path in paths:
+        add_stat(path)
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                add_stat(os.path.join(path, name))
+    return digest.hexdigest()
+
+
+def load_pickle(path):
+    """Return data saved by save_pickle(), or None if it can't be read."""
+    try:
+        with open(path, 'rb') as fin:
+            return pickle.load(fin)
+    except (IOError, OSError, EOFError, pickle.UnpicklingError,
+            AttributeError, ImportError, IndexError, ValueError):
+        return None
+
+
+def save_pickle(path, data):
+    """Save data to a file, creating the directory if needed."""
+    cache_dir = os.path.dirname(path)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    # Write to a temporary file first so concurrent runs never read a
+    # partially written cache
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir)
+    try:
+        with os.fdopen(fd, 'wb') as fout:
+            pickle.dump(data, fout, protocol=pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+class PersistentTracerCache(object):
+    """Save and load a TracerCache in a file under the user's cache dir.
+
+    The saved results are thrown away when any of the database paths change,
+    so they are only reused while the apt and rosdep databases are the same.
+    """
+
+    def __init__(self, name, database_paths, node_types=None, cache_dir=None, quiet=True):
+        if cache_dir is None:
+            cache_dir = default_cache_dir()
+        file_name = hashlib.sha1(name.encode('utf-8')).hexdigest() + '.pickle'
+        self._path = os.path.join(cache_dir, file_name)
+        self.name = name
+        self._database_paths = database_paths
+        self._node_types = node_types
+        self._quiet = quiet
+        self._loaded_nodes = 0
+        # Extra data saved along with the results by the caller
+        self.metadata = None
+
+    def fingerprint(self):
+        """Return a hash that changes when saved results stop being valid."""
+        return fingerprint_paths(self._database_paths)
+
+    def load(self):
+        """Return a TracerCache with results from a previous run, if any."""
+        cache = TracerCache()
+        with current_stats().phase('load results'):
+            data = load_pickle(self._path)
+            if not isinstance(data, dict) or \
+                    data.get('version') != CACHE_FORMAT_VERSION or \
+                    data.get('name') != self.name or \
+                    data.get('fingerprint') != self.fingerprint():
+                return cache
+            cache.import_data(data['results'])
+        self._loaded_nodes = cache.num_explored()
+        current_stats().count('results loaded', self._loaded_nodes)
+        self.metadata = data.get('metadata')
+        return cache
+
+    def save(self, cache, metadata=None):
+        """Write fully explored results in the cache to disk."""
+        if cache.num_explored() == self._loaded_nodes and metadata == self.metadata:
+            # Nothing new was learned
+            return
+        try:
+            with current_stats().phase('save results'):
+                data = {
+                    'version': CACHE_FORMAT_VERSION,
+                    'name': self.name,
+                    'fingerprint': self.fingerprint(),
+                    'results': cache.export_data(node_types=self._node_types),
+                    'metadata': metadata,
+                }
+                save_pickle(self._path, data)
+        except (IOError, OSError) as e:
+            if not self._quiet:
+                sys.stderr.write('Failed to save cache {}: {}\n'.format(self._path, e))
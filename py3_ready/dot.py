@@ -12,36 +12,82 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+"""Write dependency graphs in DOT and JSON Lines formats.
 
-def paths_to_dot(paths, edge_legend=None, node_legend=None):
-    """Given dependency paths, output in dot format for graphviz."""
+Graphs are written a line at a time as edges are produced, so the whole
+output is never held in memory.
+JSON Lines are written in constant memory, while DOT keeps every node seen so
+each is declared once, so its memory grows with the number of nodes.
+"""
+
+import json
+
+from .stats import current_stats
+
+
+def dot_lines(edges, edge_legend=None, node_legend=None):
+    """Yield lines of a dot graph for graphviz, given dependency edges.
+
+    Edge lines are yielded as edges are produced, but nodes are collected in
+    a set and declared at the end.
+    """
     if edge_legend is None:
         edge_legend = {}
     if node_legend is None:
         node_legend = {}
-    edges = []
+    yield 'digraph G {\n'
     nodes = set()
-    for edge in paths:
+    for edge in edges:
         style = ''
         if edge.edge_type in edge_legend:
             style = edge_legend[edge.edge_type]
-        edges.append('  "{beg}%{begtype}" -> "{end}%{endtype}"{style};  // {rawtype}\n'.format(
+        yield '  "{beg}%{begtype}" -> "{end}%{endtype}"{style};  // {rawtype}\n'.format(
             beg=edge.start.name,
             begtype=edge.start.node_type,
             end=edge.end.name,
             endtype=edge.end.node_type,
             style=style,
-            rawtype=edge.edge_type))
+            rawtype=edge.edge_type)
         nodes.add(edge.start)
         nodes.add(edge.end)
-    node_dot = []
+    yield '\n'
     for node in nodes:
         style = ''
         if node.node_type in node_legend:
             style = node_legend[node.node_type]
-        node_dot.append('  "{name}%{ntype}"{style}[label="{name}"];  // {ntype}\n'.format(
-            name=node.name, style=style, ntype=node.node_type))
+        yield '  "{name}%{ntype}"{style}[label="{name}"];  // {ntype}\n'.format(
+            name=node.name, style=style, ntype=node.node_type)
+    yield '}'
+
+
+def paths_to_dot(paths, edge_legend=None, node_legend=None):
+    """Given dependency paths, output in dot format for graphviz."""
+    return ''.join(dot_lines(paths, edge_legend=edge_legend, node_legend=node_legend))
+
+
+def write_dot(edges, fout, edge_legend=None, node_legend=None):
+    """Write a dot graph to a file object as edges are produced."""
+    for line in dot_lines(edges, edge_legend=edge_legend, node_legend=node_legend):
+        fout.write(line)
+    fout.write('\n')
+
+
+def write_json_lines(edges, fout):
+    """Write one JSON object per edge to a file object."""
+    for edge in edges:
+        fout.write(json.dumps({
+            'start': edge.start.name,
+            'start_type': edge.start.node_type,
+            'edge_type': edge.edge_type,
+            'end': edge.end.name,
+            'end_type': edge.end.node_type,
+        }, sort_keys=True) + '\n')
+
 
-    return 'digraph G {{\n{edges}\n{nodes}}}'.format(
-        edges=''.join(edges),
-        nodes=''.join(node_dot))
+def write_graph(edges, fout, json_lines=False, edge_legend=None, node_legend=None):
+    """Write edges as JSON Lines if json_lines is True, else as a dot graph."""
+    with current_stats().phase('output'):
+        if json_lines:
+            write_json_lines(edges, fout)
+        else:
+            write_dot(edges, fout, edge_legend=edge_legend, node_legend=node_legend)
@@ -16,168 +16,487 @@
 
 from __future__ import print_function
 
+import hashlib
+import multiprocessing
 import os
 import sys
+import threading
 
+from .apt_tracer import add_fail_fast_argument
+from .apt_tracer import add_json_lines_argument
+from .apt_tracer import add_shortest_argument
+from .apt_tracer import APT_DEPENDENCY_TYPES
 from .apt_tracer import APT_EDGE_LEGEND
+from .apt_tracer import APT_NODE
+from .apt_tracer import apt_targets
+from .apt_tracer import DEFAULT_APT_DEPENDENCY_TYPES
+from .apt_tracer import dependency_types_key
+from .apt_tracer import get_apt_database_paths
+from .apt_tracer import print_shortest_paths
+from .apt_tracer import shortest_count
+from .dependency_tracer import cached_verdicts
 from .dependency_tracer import DependencyTracer
-from .dependency_tracer import Edge
+from .dependency_tracer import known_dead_ends
 from .dependency_tracer import Node
+from .dependency_tracer import paths_to_targets
+from .dependency_tracer import reaches_target
+from .dependency_tracer import shortest_paths
+from .dependency_tracer import trace
 from .dependency_tracer import TracerCache
-from .dot import paths_to_dot
+from .disk_cache import default_cache_dir
+from .disk_cache import fingerprint_paths
+from .disk_cache import load_pickle
+from .disk_cache import PersistentTracerCache
+from .disk_cache import save_pickle
+from .dot import write_graph
+from .resources import Resources
+from .rosdep import get_rosdep_cache_index
+from .rosdep import get_rosdep_environment
 from .rosdep import is_rosdep_initialized
 from .rosdep import ROSDEP_EDGE_LEGEND
 from .rosdep import ROSDEP_NODE
 from .rosdep import ROSDEP_NODE_LEGEND
 from .rosdep import RosdepTracer
+from .stats import current_stats
 
-from apt.cache import Cache
 from catkin_pkg.package import parse_package
-from catkin_pkg.packages import find_packages
+from catkin_pkg.packages import find_package_paths
 
 
 PACKAGE_NODE='package'
 
+# Environment variables with prefixes to look for packages in
+PREFIX_PATH_ENV_VARS = (
+    'AMENT_PREFIX_PATH',
+    'CMAKE_PREFIX_PATH',
+    'COLCON_PREFIX_PATH'
+)
+
+# Kinds of dependencies in a package.xml
+PACKAGE_DEPENDENCY_TYPES = (
+    'build_depend',
+    'buildtool_depend',
+    'build_export_depend',
+    'buildtool_export_depend',
+    'exec_depend',
+    'test_depend',
+    'doc_depend',
+    'group_depend',
+)
+
+# Starting a pool of processes only pays off when there are many files to parse
+PARALLEL_PARSE_THRESHOLD = 100
+
+# Bump when the layout of the manifest cache changes
+MANIFEST_CACHE_FORMAT_VERSION = 1
+
+
+def get_dependencies(pkg):
+    """Return (dependency, rawtype) pairs for every dependency of a package."""
+    depends = []
+    for dep in pkg.build_depends:
+        depends.append((dep, 'build_depend'))
+    for dep in pkg.buildtool_depends:
+        depends.append((dep, 'buildtool_depend'))
+    for dep in pkg.build_export_depends:
+        depends.append((dep, 'build_export_depend'))
+    for dep in pkg.buildtool_export_depends:
+        depends.append((dep, 'buildtool_export_depend'))
+    for dep in pkg.exec_depends:
+        depends.append((dep, 'exec_depend'))
+    for dep in pkg.test_depends:
+        depends.append((dep, 'test_depend'))
+    for dep in pkg.doc_depends:
+        depends.append((dep, 'doc_depend'))
+    for dep in pkg.group_depends:
+        depends.append((dep, 'group_depend'))
+    return depends
+
+
+def hash_file(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as fin:
+        digest.update(fin.read())
+    return digest.hexdigest()
+
+
+def create_package_disk_cache(
+        targets, quiet=True, dependency_types=None, apt_dependency_types=None):
+    """Return a persistent cache for results of tracing ROS packages.
+
+    Results for packages are only valid while their package.xml files stay
+    the same, so PackageTracer.forget_changed_packages() must be called with
+    the stamps saved in the cache's metadata before using it.
+    """
+    name_parts = ['package', ','.join(targets)] + get_rosdep_environment()
+    name_parts.append(dependency_types_key(dependency_types, PACKAGE_DEPENDENCY_TYPES))
+    name_parts.append(dependency_types_key(apt_dependency_types, DEFAULT_APT_DEPENDENCY_TYPES))
+    name_parts.extend(os.getenv(var, '') for var in PREFIX_PATH_ENV_VARS)
+    return PersistentTracerCache(
+        ':'.join(name_parts),
+        get_apt_database_paths() + [get_rosdep_cache_index()],
+        quiet=quiet)
+
+
+def _parse_manifest(filename):
+    return filename, parse_package(filename)
+
+
+def parse_manifests(filenames):
+    """Return {filename: parsed package} for package.xml files.
+
+    Many files are parsed in a pool of processes.
+    """
+    current_stats().count('package.xml files parsed', len(filenames))
+    with current_stats().phase('parse package.xml'):
+        return _parse_manifests(filenames)
+
+
+def _parse_manifests(filenames):
+    if len(filenames) > PARALLEL_PARSE_THRESHOLD:
+        try:
+            pool = multiprocessing.Pool()
+        except OSError:
+            # multiprocessing isn't available in some chroots
+            pool = None
+        if pool is not None:
+            try:
+                return dict(pool.map(_parse_manifest, filenames))
+            finally:
+                pool.close()
+                pool.join()
+    return dict(_parse_manifest(filename) for filename in filenames)
+
+
+class ManifestCache(object):
+    """Parsed package.xml files saved between runs.
+
+    A file is only parsed again when its mtime or size changes.
+    """
+
+    def __init__(self, search_paths, cache_dir=None, quiet=True):
+        if cache_dir is None:
+            cache_dir = default_cache_dir()
+        # One file per set of prefixes so it only holds manifests that are used
+        name = ':'.join(['manifests'] + list(search_paths))
+        file_name = hashlib.sha1(name.encode('utf-8')).hexdigest() + '.pickle'
+        self._path = os.path.join(cache_dir, file_name)
+        self._quiet = quiet
+        # Key: filename, Value: (mtime, size, parsed package)
+        self._parsed = None
+        self._changed = False
+
+    def _load(self):
+        data = load_pickle(self._path)
+        if isinstance(data, dict) and data.get('version') == MANIFEST_CACHE_FORMAT_VERSION:
+            self._parsed = data['parsed']
+        else:
+            self._parsed = {}
+
+    def parse(self, filenames):
+        """Return {filename: parsed package}, parsing only files that changed."""
+        if self._parsed is None:
+            self._load()
+        stats = {}
+        to_parse = []
+        for filename in filenames:
+            st = os.stat(filename)
+            stats[filename] = (st.st_mtime, st.st_size)
+            old = self._parsed.get(filename)
+            if old is None or old[:2] != stats[filename]:
+                to_parse.append(filename)
+
+        current_stats().count('package.xml cache hits', len(filenames) - len(to_parse))
+        for filename, pkg in parse_manifests(to_parse).items():
+            self._parsed[filename] = stats[filename] + (pkg,)
+            self._changed = True
+        return dict((filename, self._parsed[filename][2]) for filename in filenames)
+
+    def save(self):
+        if self._parsed is None:
+            return
+        for filename in list(self._parsed.keys()):
+            if not os.path.exists(filename):
+                del self._parsed[filename]
+                self._changed = True
+        if not self._changed:
+            return
+        data = {
+            'version': MANIFEST_CACHE_FORMAT_VERSION,
+            'parsed': self._parsed,
+        }
+        try:
+            save_pickle(self._path, data)
+        except (IOError, OSError) as e:
+            if not self._quiet:
+                sys.stderr.write('Failed to save cache {}: {}\n'.format(self._path, e))
 
-class PackageCache(object):
 
-    def __init__(self):
+class PackageCache(object):
+    """Finds and parses package.xml files in the sourced workspaces.
+
+    Prefixes are searched in the order they appear in the environment, and
+    a package in an earlier prefix shadows packages of the same name in later
+    ones, the same as sourcing an overlay workspace on top of an underlay.
+
+    Normally every package is found up front.
+    In lazy mode a package is only looked for when it's first asked for,
+    so only package.xml files of packages being traced are read.
+    Packages may be looked up from several threads in either mode.
+    """
+
+    def __init__(self, use_disk_cache=False, quiet=True, lazy=False):
+        self._search_paths = list(self._get_search_paths())
+        self._manifest_cache = None
+        if use_disk_cache:
+            self._manifest_cache = ManifestCache(self._search_paths, quiet=quiet)
+        self._lazy = lazy
         # Key: name, Value: parsed package xml file
-        self._packages = self._find_packages(self._get_search_paths())
+        self._packages = {}
+        # Key: name, Value: prefix the package was found in
+        self._prefixes = {}
+        # Names known not to be packages, in lazy mode
+        self._not_packages = set()
+        self._lazy_lock = threading.Lock()
+        if not lazy:
+            self._find_packages(self._search_paths)
 
     def _get_search_paths(self):
-        env_vars = (
-            'AMENT_PREFIX_PATH',
-            'CMAKE_PREFIX_PATH',
-            'COLCON_PREFIX_PATH'
-        )
-        paths = []
-        for var in env_vars:
+        # The same prefix is often in several of these
+        seen = set()
+        for var in PREFIX_PATH_ENV_VARS:
             text = os.getenv(var, default='')
             for path in text.split(':'):
-                if path:
+                if path and os.path.realpath(path) not in seen:
+                    seen.add(os.path.realpath(path))
                     yield path
 
+    def _parse(self, filenames):
+        if self._manifest_cache is not None:
+            return self._manifest_cache.parse(filenames)
+        return parse_manifests(filenames)
+
     def _find_packages(self, search_paths):
-        packages = {}
-        for path in search_paths:
-            for path, pkg in find_packages(path).items():
-                # TODO(sloretz) is this doing overlay workspaces correctly?
-                packages[pkg.name] = pkg
-        return packages
+        # Find every package.xml first so they can all be parsed at once
+        filenames = []
+        with current_stats().phase('find packages'):
+            for path in search_paths:
+                for package_path in sorted(find_package_paths(path)):
+                    filenames.append((path, os.path.join(path, package_path, 'package.xml')))
+
+        parsed = self._parse([filename for _, filename in filenames])
+        for path, filename in filenames:
+            pkg = parsed[filename]
+            # The first prefix a package is in shadows the rest
+            if pkg.name not in self._packages:
+                self._packages[pkg.name] = pkg
+                self._prefixes[pkg.name] = path
+
+    def _find_package_lazily(self, name):
+        for path in self._search_paths:
+            # ament registers packages in its resource index at
+            # share/ament_index/resource_index/packages/<name>, but both ament
+            # and catkin install the package.xml itself to share/<name>
+            filename = os.path.join(path, 'share', name, 'package.xml')
+            if os.path.isfile(filename):
+                pkg = self._parse([filename])[filename]
+                if pkg.name == name:
+                    self._packages[name] = pkg
+                    self._prefixes[name] = path
+                    return pkg
+        self._not_packages.add(name)
 
     def find_package(self, name):
         if name in self._packages:
             return self._packages[name]
+        if self._lazy and name not in self._not_packages:
+            with self._lazy_lock:
+                if name in self._packages:
+                    # Found by another thread while this one waited
+                    return self._packages[name]
+                if name not in self._not_packages:
+                    return self._find_package_lazily(name)
+
+    def find_prefix(self, name):
+        """Return the prefix a package was found in, or None if it isn't a package."""
+        if self.find_package(name) is not None:
+            return self._prefixes[name]
+
+    def package_names(self):
+        """Return names of all packages, or in lazy mode those found so far."""
+        return sorted(self._packages.keys())
+
+    def fingerprint(self):
+        """Return a hash that changes when a package.xml file that was found changes.
+
+        Packages installed to or removed from <prefix>/share change it too.
+        """
+        paths = [os.path.join(path, 'share') for path in self._search_paths]
+        paths.extend(sorted(pkg.filename for pkg in self._packages.values()))
+        return fingerprint_paths(paths)
+
+    def save(self):
+        """Save parsed package.xml files for later runs."""
+        if self._manifest_cache is not None:
+            self._manifest_cache.save()
+
+    def _find_recursively(self, names):
+        stack = list(names)
+        while stack:
+            pkg = self.find_package(stack.pop())
+            if pkg is None:
+                continue
+            for dep, _ in get_dependencies(pkg):
+                if dep.name not in self._packages and dep.name not in self._not_packages:
+                    stack.append(dep.name)
+
+    def get_manifest_stamps(self, old_stamps=None):
+        """Return {name: (path, mtime, size, sha1)} for each package.xml file.
+
+        Files are only hashed again if their mtime or size changed since
+        old_stamps.
+        In lazy mode only packages that were found are stamped.
+        """
+        if old_stamps is None:
+            old_stamps = {}
+        if self._lazy:
+            # Look up packages that were stamped before and their dependencies
+            # so changes to any of them are noticed
+            self._find_recursively(old_stamps)
+        stamps = {}
+        for name, pkg in self._packages.items():
+            st = os.stat(pkg.filename)
+            old = old_stamps.get(name)
+            if old is not None and old[:3] == (pkg.filename, st.st_mtime, st.st_size):
+                stamps[name] = old
+            else:
+                stamps[name] = (pkg.filename, st.st_mtime, st.st_size, hash_file(pkg.filename))
+        return stamps
+
+    def find_dependents(self, names):
+        """Return the given names and names of packages recursively depending on them.
+
+        In lazy mode only packages that were found are searched.
+        """
+        reverse_edges = {}
+        for name, pkg in self._packages.items():
+            for dep, _ in get_dependencies(pkg):
+                reverse_edges.setdefault(dep.name, set()).add(name)
+        dependents = set(names)
+        stack = list(names)
+        while stack:
+            for dependent in reverse_edges.get(stack.pop(), ()):
+                if dependent not in dependents:
+                    dependents.add(dependent)
+                    stack.append(dependent)
+        return dependents
 
 
 
 class PackageTracer(DependencyTracer):
+    """Trace dependencies of ROS packages.
 
-    def __init__(self, apt_cache=None, quiet=True):
-        self._quiet = quiet
-        self._tracer = RosdepTracer(apt_cache=apt_cache, quiet=self._quiet)
-        self._package_cache = PackageCache()
+    Only package.xml dependencies of the given dependency_types and debian
+    dependencies of the given apt_dependency_types are followed.
+    """
 
-    def trace_paths(self, start, target, cache=None):
-        # start: name of a ROS package
-        # target: name of a debian package
+    def __init__(
+            self, apt_cache=None, quiet=True, resolver=None, package_cache=None,
+            dependency_types=None, apt_dependency_types=None, apt_backend=None):
+        self._quiet = quiet
+        self._tracer = RosdepTracer(
+            apt_cache=apt_cache, quiet=self._quiet, resolver=resolver,
+            apt_backend=apt_backend, apt_dependency_types=apt_dependency_types)
+        if package_cache is None:
+            package_cache = PackageCache(quiet=self._quiet)
+        self._package_cache = package_cache
+        if dependency_types is None:
+            dependency_types = PACKAGE_DEPENDENCY_TYPES
+        self._dependency_types = frozenset(dependency_types)
+
+    def package_names(self):
+        return self._package_cache.package_names()
+
+    def forget_changed_packages(self, cache, old_stamps):
+        """Forget cached results of packages whose package.xml changed.
+
+        Packages depending on them are forgotten too, as are packages
+        depending on packages that were added or removed.
+        old_stamps are the stamps that were saved with the results.
+        Returns stamps to save with the results.
+        """
+        stamps = self._package_cache.get_manifest_stamps(old_stamps)
+
+        def identity(stamp):
+            # Path and content of a package.xml
+            if stamp is not None:
+                return stamp[0], stamp[3]
+
+        changed = [
+            name for name in set(stamps) | set(old_stamps)
+            if identity(stamps.get(name)) != identity(old_stamps.get(name))]
+        forgotten = self._package_cache.find_dependents(changed)
+        cache.forget(Node(name, PACKAGE_NODE) for name in forgotten)
+        return stamps
+
+    def _find_start_package(self, start):
         start_pkg = self._package_cache.find_package(start)
         if start_pkg is None:
             if not self._quiet:
                 sys.stderr.write('Failed to find package "{}".'
                 ' Did you remember to source the workspace?\n'.format(start))
             raise KeyError()
+        return start_pkg
 
+    def trace_targets(self, start, targets, cache=None):
         if not cache:
             cache = TracerCache()
-        self._cache = cache
-
-        self._visited_pkgs = []
-        self._deferred_pkgs = set()
-        self._pkgs_to_target = set([])
-        self._visited_rosdeps = []
-        self._rosdeps_to_target = set([])
-
-        self._trace_path(start_pkg, target)
-        # Need extra passes for circular dependencies
-        while self._deferred_pkgs:
-            def_pkgs = self._deferred_pkgs
-            self._deferred_pkgs = set()
-            for def_pkg in def_pkgs:
-                self._trace_path(def_pkg, target)
+        start_node, bits, _ = self.trace_into_cache(start, targets, cache)
+        return paths_to_targets(start_node, bits, APT_NODE, cache)
+
+    def trace_into_cache(self, start, targets, cache):
+        # start: name of a ROS package
+        # targets: names of debian packages
+        start_pkg = self._find_start_package(start)
+        bits = cache.target_bits(targets)
+        target_mask = apt_targets(bits)
+
         start_node = Node(start_pkg.name, PACKAGE_NODE)
-        return list(set(self._cache.recursive_edges(start_node)))
-
-    def _trace_path(self, start, target):
-        """return true if path leads to target debian package"""
-        start_node = Node(start.name, PACKAGE_NODE)
-        if self._cache.check_visited(start_node):
-            if self._cache.check_fully_explored(start_node):
-                leads_to_target = self._cache.check_leads_to_target(start_node)
-                return leads_to_target
-            else:
-                # Defer checks on circular dependencies
-                self._deferred_pkgs.add(start)
-                return False
-        self._cache.visit(start_node)
-
-        depends = []
-        for dep in start.build_depends:
-            depends.append((dep, 'build_depend'))
-        for dep in start.buildtool_depends:
-            depends.append((dep, 'buildtool_depend'))
-        for dep in start.build_export_depends:
-            depends.append((dep, 'build_export_depend'))
-        for dep in start.buildtool_export_depends:
-            depends.append((dep, 'buildtool_export_depend'))
-        for dep in start.exec_depends:
-            depends.append((dep, 'exec_depend'))
-        for dep in start.test_depends:
-            depends.append((dep, 'test_depend'))
-        for dep in start.doc_depends:
-            depends.append((dep, 'doc_depend'))
-        for dep in start.group_depends:
-            depends.append((dep, 'group_depend'))
-
-        rosdep_keys = []
-        for dep, _ in depends:
+        if not cache.check_fully_explored(start_node):
+            for target in targets:
+                self._tracer.check_in_apt_cache(target)
+            trace(start_node, target_mask, self.successors, cache)
+        return start_node, bits, target_mask
+
+    def depends_on_any(self, start, targets, cache=None):
+        start_pkg = self._find_start_package(start)
+        for target in targets:
+            self._tracer.check_in_apt_cache(target)
+        return reaches_target(
+            Node(start_pkg.name, PACKAGE_NODE), apt_targets(dict((t, 1) for t in targets)),
+            self.successors, verdict=cached_verdicts(cache, targets))
+
+    def trace_shortest_paths(self, start, target, k=1, cache=None):
+        start_pkg = self._find_start_package(start)
+        self._tracer.check_in_apt_cache(target)
+        return shortest_paths(
+            Node(start_pkg.name, PACKAGE_NODE), apt_targets({target: 1}), self.successors,
+            k=k, is_dead_end=known_dead_ends(cache, target))
+
+    def successors(self, node):
+        if node.node_type != PACKAGE_NODE:
+            return self._tracer.successors(node)
+        pkg = self._package_cache.find_package(node.name)
+        successors = []
+        for dep, rawtype in get_dependencies(pkg):
+            if rawtype not in self._dependency_types:
+                continue
             if self._package_cache.find_package(dep.name) is None:
-                rosdep_keys.append(dep.name)
-
-        leads_to_target = False
-        for dep, rawtype in depends:
-            if dep.name in rosdep_keys:
-                dep_node = Node(dep.name, ROSDEP_NODE)
-                dep_leads_to_target = False
-                if self._cache.check_fully_explored(dep_node):
-                    dep_leads_to_target = self._cache.check_leads_to_target(dep_node)
-                else:
-                    # Trace rosdep key to target
-                    rosdep_paths = self._tracer.trace_paths(dep.name, target, cache=self._cache)
-                    if rosdep_paths:
-                        dep_leads_to_target = True
-                if dep_leads_to_target:
-                    leads_to_target = True
-                    edge = Edge(
-                        start_node,
-                        rawtype,
-                        dep_node
-                    )
-                    self._cache.add_edge(edge)
-                    leads_to_target = True
+                # Anything that isn't a package is assumed to be a rosdep key
+                successors.append((rawtype, Node(dep.name, ROSDEP_NODE)))
             else:
-                pkg = self._package_cache.find_package(dep.name)
-                if pkg is None and not self._quiet:
-                    sys.stderr.write('Failed to find package or rosdep key [{}]\n'.format(dep.name))
-                dep_node = Node(dep.name, PACKAGE_NODE)
-                if self._trace_path(pkg, target):
-                    edge = Edge(start_node, rawtype, dep_node)
-                    self._cache.add_edge(edge)
-                    leads_to_target = True
-
-        self._cache.mark_leads_to_target(start_node, leads_to_target)
-        return leads_to_target
+                successors.append((rawtype, Node(dep.name, PACKAGE_NODE)))
+        return successors
 
 
 PACKAGE_EDGE_LEGEND = {
@@ -197,34 +516,164 @@ PACKAGE_NODE_LEGEND = {
 
 
 class CheckPackageCommand(object):
-    COMMAND_NAME='check-package'
-    COMMAND_HELP='check if a ROS package depends on python 2'
 
-    def __init__(self, parser):
+    def __init__(self, parser, resources=None):
+        if resources is None:
+            resources = Resources()
+        self._resources = resources
         # arguments for key, quiet, and dot output
         parser.add_argument(
-            'package', type=str,
+            'package', type=str, nargs='*',
             help='Name of a package to check')
+        parser.add_argument(
+            '--all', action='store_true',
+            help='check every package in the sourced workspaces')
         parser.add_argument('--quiet', action='store_true')
         parser.add_argument(
             '--dot', action='store_true', help='output DOT graph')
+        add_json_lines_argument(parser)
         parser.add_argument(
-            '--target', default='python',
-            help='Debian package to trace to (default python)')
+            '--target', action='append',
+            help='Debian package to trace to, may be given more than once (default python)')
+        parser.add_argument(
+            '--no-cache', action='store_true',
+            help='do not read or write results cached by previous runs')
+        parser.add_argument(
+            '--lazy', action='store_true',
+            help='only read package.xml files of packages being traced; '
+                 'packages must be installed to <prefix>/share/<name>')
+        parser.add_argument(
+            '--dependency-type', action='append',
+            choices=PACKAGE_DEPENDENCY_TYPES + APT_DEPENDENCY_TYPES,
+            help='only follow package.xml or debian dependencies of this type, '
+                 'may be given more than once (default every package.xml type, '
+                 'and Depends and PreDepends)')
+        add_shortest_argument(parser)
+        add_fail_fast_argument(parser)
 
     def do_command(self, args):
-        all_paths = []
-        tracer = PackageTracer(quiet=args.quiet)
+        if not args.package and not args.all:
+            sys.stderr.write('Expected a package name or --all\n')
+            return 2
+        shortest = shortest_count(args)
+        if shortest is not None and shortest < 1:
+            sys.stderr.write('--shortest-count must be at least 1\n')
+            return 2
+        if args.dot and args.jsonl:
+            sys.stderr.write('--dot can not be used with --jsonl\n')
+            return 2
+        graph = args.dot or args.jsonl
+        if args.fail_fast and (graph or shortest is not None):
+            sys.stderr.write(
+                '--fail-fast can not be used with --dot, --jsonl, or --shortest\n')
+            return 2
+        targets = args.target or ['python']
+
+        # Kinds of dependencies not mentioned are all followed
+        dependency_types = None
+        apt_dependency_types = None
+        if args.dependency_type:
+            dependency_types = [
+                t for t in args.dependency_type if t in PACKAGE_DEPENDENCY_TYPES] or None
+            apt_dependency_types = [
+                t for t in args.dependency_type if t in APT_DEPENDENCY_TYPES] or None
 
         try:
-            all_paths = tracer.trace_paths(args.package, args.target)
+            package_cache = self._resources.package_cache(
+                use_disk_cache=not args.no_cache, quiet=args.quiet,
+                lazy=args.lazy and not args.all)
+            tracer = PackageTracer(
+                quiet=args.quiet, package_cache=package_cache,
+                resolver=self._resources.rosdep_resolver(quiet=args.quiet),
+                apt_backend=self._resources.apt_backend(),
+                dependency_types=dependency_types,
+                apt_dependency_types=apt_dependency_types)
         except OSError as e:
             sys.stderr.write(str(e) + '\n')
             return 2
-        except KeyError:
+
+        packages = list(args.package)
+        if args.all:
+            packages.extend(
+                name for name in tracer.package_names() if name not in packages)
+        if not packages:
+            sys.stderr.write(
+                'No packages found. Did you remember to source the workspace?\n')
+            return 2
+
+        # One cache shared by all packages so common dependencies are only
+        # traced once
+        disk_cache = None
+        if args.no_cache:
+            cache = TracerCache()
+        else:
+            # Only packages whose package.xml changed since the last run, and
+            # packages depending on them, are traced again
+            disk_cache = self._resources.results_cache(create_package_disk_cache(
+                targets, quiet=args.quiet, dependency_types=dependency_types,
+                apt_dependency_types=apt_dependency_types))
+            cache = disk_cache.load()
+            stamps = tracer.forget_changed_packages(cache, disk_cache.metadata or {})
+
+        if args.fail_fast:
+            # The cache is only read, so it doesn't need to be saved
+            return self._check_fail_fast(tracer, packages, targets, cache, args.quiet)
+
+        # Edges of shortest chains aren't in the cache, so they're collected
+        all_paths = set()
+        depends_on_target = False
+        # (package, targets it depends on), or (package, None) if it failed
+        results = []
+        # Key: package, Value: {target: shortest chains} when using --shortest
+        shortest_chains = {}
+        failed = False
+        for package in packages:
+            try:
+                if shortest is not None:
+                    chains = tracer.trace_shortest_targets(
+                        package, targets, k=shortest, cache=cache)
+                    shortest_chains[package] = chains
+                    paths = dict(
+                        (target, [edge for chain in chains[target] for edge in chain])
+                        for target in targets)
+                else:
+                    # Only the verdict is needed, edges are read from the
+                    # shared cache for --dot and --jsonl
+                    paths = tracer.trace_verdicts(package, targets, cache=cache)
+            except OSError as e:
+                sys.stderr.write(str(e) + '\n')
+                results.append((package, None))
+                failed = True
+                continue
+            except (KeyError, ValueError):
+                results.append((package, None))
+                failed = True
+                continue
+            if graph and shortest is not None:
+                for target in targets:
+                    all_paths.update(paths[target])
+            depends = [t for t in targets if paths[t]]
+            depends_on_target = depends_on_target or bool(depends)
+            results.append((package, depends))
+
+        if disk_cache is not None:
+            # In lazy mode more packages may have been found while tracing
+            stamps = package_cache.get_manifest_stamps(stamps)
+            disk_cache.save(cache, metadata=stamps)
+        package_cache.save()
+
+        if len(results) == 1 and failed:
             return 2
 
-        if args.dot:
+        if graph:
+            if shortest is not None:
+                edges = all_paths
+            else:
+                bits = cache.target_bits(targets)
+                edges = cache.edges_to_targets(
+                    [Node(package, PACKAGE_NODE)
+                        for package, depends in results if depends is not None],
+                    dict((Node(t, APT_NODE), bits[t]) for t in targets))
             edge_legend = {}
             edge_legend.update(APT_EDGE_LEGEND)
             edge_legend.update(ROSDEP_EDGE_LEGEND)
@@ -232,18 +681,67 @@ class CheckPackageCommand(object):
             node_legend = {}
             node_legend.update(ROSDEP_NODE_LEGEND)
             node_legend.update(PACKAGE_NODE_LEGEND)
-            print(paths_to_dot(
-                all_paths,
+            write_graph(
+                edges, sys.stdout, json_lines=args.jsonl,
                 edge_legend=edge_legend,
-                node_legend=node_legend))
+                node_legend=node_legend)
+        elif not args.quiet and shortest is not None:
+            for package, depends in results:
+                if depends is None:
+                    continue
+                for target in targets:
+                    print_shortest_paths(package, target, shortest_chains[package][target])
         elif not args.quiet:
-            if all_paths:
-                print('{} depends on {}'.format(args.package, args.target))
+            if len(results) == 1:
+                package, depends = results[0]
+                for target in targets:
+                    if target in depends:
+                        print('{} depends on {}'.format(package, target))
+                    else:
+                        print('{} does not depend on {}'.format(package, target))
             else:
-                print('{} does not depend on {}'.format(args.path, args.target))
+                print_verdict_table(results, targets)
 
-        if all_paths:
+        if failed:
+            return 2
+        if depends_on_target:
             # non-zero exit code to indicate it does depend on target
             # because it's assumed depending on target is undesirable
             return 1
         return 0
+
+    def _check_fail_fast(self, tracer, packages, targets, cache, quiet):
+        failed = False
+        for package in packages:
+            try:
+                depends = tracer.depends_on_any(package, targets, cache=cache)
+            except OSError as e:
+                sys.stderr.write(str(e) + '\n')
+                failed = True
+                continue
+            except (KeyError, ValueError):
+                failed = True
+                continue
+            if depends:
+                if not quiet:
+                    print('{} depends on {}'.format(package, ' or '.join(targets)))
+                return 1
+            if not quiet:
+                print('{} does not depend on {}'.format(package, ' or '.join(targets)))
+        if failed:
+            return 2
+        return 0
+
+
+def print_verdict_table(results, targets):
+    """Print one line per package saying which targets it depends on."""
+    width = max(len(package) for package, _ in results)
+    for package, depends in results:
+        if depends is None:
+            verdict = 'error'
+        elif depends:
+            verdict = 'depends on {}'.format(', '.join(depends))
+        else:
+            verdict = 'does not depend on {}'.format(' or '.join(targets))
+        print('{package:<{width}}  {verdict}'.format(
+            package=package, width=width, verdict=verdict))
@@ -0,0 +1,49 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Databases the check commands read, created fresh for every run."""
+
+from .apt_backend import AptPkgBackend
+from .apt_snapshot import AptSnapshot
+
+
+class Resources(object):
+    """Creates the apt backend, rosdep resolver, and package cache a command uses.
+
+    Every command run from the command line gets new ones.
+    `py3-ready serve` uses a subclass keeping them loaded between commands.
+    rosdep2 and catkin_pkg are only imported by the methods needing them, so
+    check-apt works without them.
+    """
+
+    def apt_backend(self, snapshot=None):
+        """Return a backend reading a snapshot file if given, else the apt cache."""
+        if snapshot is not None:
+            return AptSnapshot.load(snapshot)
+        return AptPkgBackend()
+
+    def rosdep_resolver(self, quiet=True):
+        from .rosdep import RosdepResolver
+        return RosdepResolver(quiet=quiet)
+
+    def package_cache(self, use_disk_cache=False, quiet=True, lazy=False):
+        from .package_xml import PackageCache
+        return PackageCache(use_disk_cache=use_disk_cache, quiet=quiet, lazy=lazy)
+
+    def results_cache(self, disk_cache):
+        """Return where to load and save results of a PersistentTracerCache.
+
+        The returned object has the same load(), save(), and metadata.
+        """
+        return disk_cache
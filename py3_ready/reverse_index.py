@@ -0,0 +1,179 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tools for finding everything that depends on a debian package."""
+
+from __future__ import print_function
+
+from collections import deque
+import sys
+
+from .apt_tracer import add_apt_dependency_type_argument
+from .apt_tracer import DEFAULT_APT_DEPENDENCY_TYPES
+from .package_xml import get_dependencies
+from .package_xml import PackageCache
+from .rosdep import is_rosdep_initialized
+from .rosdep import RosdepResolver
+
+from apt.cache import Cache
+from rosdep2.platforms.debian import AptInstaller
+
+
+def reverse_reachable(reverse_edges, starts):
+    """Breadth first search over reversed edges, returning all names reached."""
+    reached = set()
+    queue = deque(starts)
+    while queue:
+        name = queue.popleft()
+        for dependent in reverse_edges.get(name, ()):
+            if dependent not in reached:
+                reached.add(dependent)
+                queue.append(dependent)
+    return reached
+
+
+class AptReverseIndex(object):
+    """Index of which apt packages depend on each apt package.
+
+    The whole apt cache is walked once, so finding everything that depends on
+    a package is a single breadth first search.
+    """
+
+    def __init__(self, apt_cache=None, dependency_types=None):
+        if apt_cache is None:
+            apt_cache = Cache()
+        if dependency_types is None:
+            dependency_types = DEFAULT_APT_DEPENDENCY_TYPES
+        # Key: package name, Value: set of names of packages depending on it
+        self._reverse_edges = {}
+        self._virtual_pkgs = set()
+        self._build(apt_cache, dependency_types)
+
+    def _add_edge(self, name, dependent):
+        if name not in self._reverse_edges:
+            self._reverse_edges[name] = set()
+        self._reverse_edges[name].add(dependent)
+
+    def _build(self, apt_cache, dependency_types):
+        is_virtual = {}
+        for pkg in apt_cache:
+            if pkg.candidate is None:
+                continue
+            for dependency in pkg.candidate.get_dependencies(*dependency_types):
+                for base_dep in dependency:
+                    name = base_dep.name
+                    if name not in is_virtual:
+                        is_virtual[name] = apt_cache.is_virtual_package(name)
+                        if is_virtual[name]:
+                            # Same as AptTracer: a virtual package is satisfied
+                            # by any package that provides it
+                            self._virtual_pkgs.add(name)
+                            for provider in apt_cache.get_providing_packages(name):
+                                self._add_edge(provider.name, name)
+                    self._add_edge(name, pkg.name)
+
+    def dependents(self, target):
+        """Return names of apt packages that recursively depend on target."""
+        dependents = reverse_reachable(self._reverse_edges, [target])
+        dependents.discard(target)
+        return dependents - self._virtual_pkgs
+
+
+def find_rosdep_dependents(resolver, apt_names):
+    """Return rosdep keys that resolve to any of the given apt packages."""
+    keys = set()
+    for key in resolver.keys():
+        resolved = resolver.resolve(key)
+        if not resolved:
+            continue
+        for installer, pkgs in resolved.items():
+            if isinstance(installer, AptInstaller) and apt_names.intersection(pkgs):
+                keys.add(key)
+    return keys
+
+
+def find_package_dependents(package_cache, rosdep_keys):
+    """Return names of ROS packages that recursively depend on any rosdep key."""
+    reverse_edges = {}
+    for name in package_cache.package_names():
+        pkg = package_cache.find_package(name)
+        for dep, _ in get_dependencies(pkg):
+            # Same as PackageTracer: anything that isn't a package is a rosdep key
+            if package_cache.find_package(dep.name) is None:
+                if dep.name not in rosdep_keys:
+                    continue
+            if dep.name not in reverse_edges:
+                reverse_edges[dep.name] = set()
+            reverse_edges[dep.name].add(name)
+    return reverse_reachable(reverse_edges, rosdep_keys)
+
+
+class ListDependentsCommand(object):
+
+    def __init__(self, parser):
+        parser.add_argument('--quiet', action='store_true')
+        parser.add_argument(
+            '--target', default='python',
+            help='Debian package to trace to (default python)')
+        parser.add_argument(
+            '--apt-only', action='store_true',
+            help='only list apt packages')
+        parser.add_argument(
+            '--no-packages', action='store_true',
+            help='do not list ROS packages in the sourced workspaces')
+        add_apt_dependency_type_argument(parser)
+
+    def do_command(self, args):
+        apt_cache = Cache()
+        if args.target not in apt_cache:
+            if not args.quiet:
+                sys.stderr.write("'{}' not in apt cache.\n".format(args.target))
+            return 2
+
+        apt_names = AptReverseIndex(
+            apt_cache, dependency_types=args.dependency_type).dependents(args.target)
+        rosdep_keys = set()
+        package_names = set()
+
+        if not args.apt_only:
+            if not is_rosdep_initialized():
+                if not args.quiet:
+                    sys.stderr.write(
+                        'The rosdep database is not ready to be used. '
+                        'Run \n\n\trosdep update\n\n')
+                return 2
+            resolver = RosdepResolver(quiet=True)
+            rosdep_keys = find_rosdep_dependents(resolver, apt_names | {args.target})
+
+            if not args.no_packages:
+                try:
+                    package_cache = PackageCache(use_disk_cache=True)
+                except OSError as e:
+                    sys.stderr.write(str(e) + '\n')
+                    return 2
+                package_names = find_package_dependents(package_cache, rosdep_keys)
+                package_cache.save()
+
+        for name in sorted(apt_names):
+            print('apt {}'.format(name))
+        for key in sorted(rosdep_keys):
+            print('rosdep {}'.format(key))
+        for name in sorted(package_names):
+            print('package {}'.format(name))
+
+        if apt_names or rosdep_keys or package_names:
+            # non-zero exit code to indicate something depends on target
+            # because it's assumed depending on target is undesirable
+            return 1
+        return 0
@@ -18,19 +18,38 @@ from __future__ import print_function
 
 import os
 import sys
+import threading
 
 from .apt_tracer import APT_EDGE_LEGEND
 from .apt_tracer import APT_NODE
+from .apt_tracer import apt_targets
+from .apt_tracer import add_apt_dependency_type_argument
+from .apt_tracer import add_fail_fast_argument
+from .apt_tracer import add_json_lines_argument
+from .apt_tracer import add_shortest_argument
+from .apt_tracer import DEFAULT_APT_DEPENDENCY_TYPES
 from .apt_tracer import AptTracer
+from .apt_tracer import dependency_types_key
+from .apt_tracer import get_apt_database_paths
+from .apt_tracer import print_shortest_paths
+from .apt_tracer import shortest_count
+from .dependency_tracer import cached_verdicts
 from .dependency_tracer import DependencyTracer
-from .dependency_tracer import Edge
+from .dependency_tracer import known_dead_ends
 from .dependency_tracer import Node
+from .dependency_tracer import paths_to_targets
+from .dependency_tracer import reaches_target
+from .dependency_tracer import shortest_paths
+from .dependency_tracer import trace
 from .dependency_tracer import TracerCache
-from .dot import paths_to_dot
+from .disk_cache import PersistentTracerCache
+from .dot import write_graph
+from .resources import Resources
+from .stats import current_stats
 
-from apt.cache import Cache
 from rosdep2 import create_default_installer_context
 from rosdep2 import get_default_installer
+from rosdep2 import ResolutionError
 from rosdep2.lookup import RosdepLookup
 from rosdep2.platforms.debian import AptInstaller
 from rosdep2.rospkg_loader import DEFAULT_VIEW_KEY
@@ -43,9 +62,12 @@ from rosdep2.sources_list import SourcesListLoader
 ROSDEP_NODE = 'rosdep'
 
 
+def get_rosdep_cache_index():
+    return os.path.join(get_sources_cache_dir(), CACHE_INDEX)
+
+
 def is_rosdep_initialized():
-    sources_cache_dir = get_sources_cache_dir()
-    filename = os.path.join(sources_cache_dir, CACHE_INDEX)
+    filename = get_rosdep_cache_index()
     if os.path.exists(filename):
         return True
     else:
@@ -61,64 +83,207 @@ def is_rosdep_initialized():
     return True
 
 
-def resolve_rosdep_key(key, quiet=False):
-    sources_loader = SourcesListLoader.create_default(
-        sources_cache_dir=get_sources_cache_dir(),
-        os_override=None,
-        verbose=False)
-    lookup = RosdepLookup.create_from_rospkg(sources_loader=sources_loader)
-    lookup.verbose = False
-
-    installer_context = create_default_installer_context(verbose=False)
-
-    installer, installer_keys, default_key, \
-        os_name, os_version = get_default_installer(
-            installer_context=installer_context,
+def get_rosdep_environment():
+    """Return values of environment variables changing how rosdep resolves keys."""
+    env_vars = ('ROS_DISTRO', 'ROS_PYTHON_VERSION', 'ROS_OS_OVERRIDE')
+    return [os.getenv(var, '') for var in env_vars]
+
+
+def create_rosdep_disk_cache(
+        targets, quiet=True, snapshot=None, os_override=None, apt_dependency_types=None):
+    """Return a persistent cache for results of tracing rosdep keys.
+
+    snapshot is the path of an apt snapshot used instead of the apt cache, and
+    os_override is the (os_name, os_version) keys are resolved for.
+    """
+    name_parts = ['rosdep', ','.join(targets)] + get_rosdep_environment()
+    name_parts.append(dependency_types_key(apt_dependency_types, DEFAULT_APT_DEPENDENCY_TYPES))
+    database_paths = [get_rosdep_cache_index()]
+    if os_override is not None:
+        name_parts.extend(os_override)
+    if snapshot is not None:
+        snapshot = os.path.abspath(snapshot)
+        name_parts.append(snapshot)
+        database_paths.append(snapshot)
+    else:
+        database_paths.extend(get_apt_database_paths())
+    return PersistentTracerCache(
+        ':'.join(name_parts),
+        database_paths,
+        (APT_NODE, ROSDEP_NODE),
+        quiet=quiet)
+
+
+class RosdepResolver(object):
+    """Resolve rosdep keys, loading the rosdep database only once.
+
+    It may be used from several threads.
+    """
+
+    def __init__(self, quiet=True):
+        self._quiet = quiet
+        self._view = None
+        self._load_lock = threading.Lock()
+        self._initialized = None
+        # Key: rosdep key, Value: {installer: resolved} or None if unresolvable
+        self._resolved = {}
+
+    def is_initialized(self):
+        """Return True if the rosdep database is ready to be used."""
+        if self._initialized is None:
+            # Only checked once instead of for every key resolved
+            self._initialized = is_rosdep_initialized()
+        return self._initialized
+
+    def _load(self):
+        with self._load_lock:
+            # Another thread may have loaded it while this one waited
+            if self._view is None:
+                with current_stats().phase('load rosdep database'):
+                    self._load_view()
+
+    def _load_view(self):
+        sources_loader = SourcesListLoader.create_default(
+            sources_cache_dir=get_sources_cache_dir(),
+            os_override=None,
             verbose=False)
+        lookup = RosdepLookup.create_from_rospkg(sources_loader=sources_loader)
+        lookup.verbose = False
 
-    view = lookup.get_rosdep_view(DEFAULT_VIEW_KEY, verbose=False)
-    try:
-        d = view.lookup(key)
-    except KeyError as e:
-        sys.stderr.write('Invalid key "{}": {}\n'.format(key, e))
-        return
+        self._installer_context = create_default_installer_context(verbose=False)
 
-    rule_installer, rule = d.get_rule_for_platform(
-        os_name, os_version, installer_keys, default_key)
+        _, self._installer_keys, self._default_key, \
+            self._os_name, self._os_version = get_default_installer(
+                installer_context=self._installer_context,
+                verbose=False)
 
-    installer = installer_context.get_installer(rule_installer)
-    resolved = installer.resolve(rule)
+        # Set last since other threads only wait for the load while it's None
+        self._view = lookup.get_rosdep_view(DEFAULT_VIEW_KEY, verbose=False)
 
-    for error in lookup.get_errors():
-        if not quiet:
-            print('WARNING: %s' % (error), file=sys.stderr)
+        for error in lookup.get_errors():
+            if not self._quiet:
+                print('WARNING: %s' % (error), file=sys.stderr)
+
+    def for_os(self, os_name, os_version):
+        """Return a resolver for another platform sharing this rosdep database.
+
+        Raises KeyError if rosdep doesn't know the OS.
+        """
+        if self._view is None:
+            self._load()
+        resolver = RosdepResolver(quiet=self._quiet)
+        resolver._view = self._view
+        resolver._installer_context = self._installer_context
+        resolver._installer_keys = self._installer_context.get_os_installer_keys(os_name)
+        resolver._default_key = self._installer_context.get_default_os_installer_key(os_name)
+        resolver._os_name = os_name
+        resolver._os_version = os_version
+        return resolver
+
+    def keys(self):
+        """Return all rosdep keys in the rosdep database."""
+        if self._view is None:
+            self._load()
+        return self._view.keys()
+
+    def resolve(self, key):
+        """Return {installer: resolved} for a key, or None if it can't be resolved."""
+        if key not in self._resolved:
+            current_stats().count('rosdep keys resolved')
+            self._resolved[key] = self._resolve(key)
+        else:
+            current_stats().count('rosdep resolution cache hits')
+        return self._resolved[key]
 
-    return {installer: resolved}
+    def _resolve(self, key):
+        if self._view is None:
+            self._load()
+        try:
+            d = self._view.lookup(key)
+        except KeyError as e:
+            if not self._quiet:
+                sys.stderr.write('Invalid key "{}": {}\n'.format(key, e))
+            return
+
+        try:
+            rule_installer, rule = d.get_rule_for_platform(
+                self._os_name, self._os_version, self._installer_keys, self._default_key)
+        except ResolutionError as e:
+            if not self._quiet:
+                sys.stderr.write('Unable to resolve key "{}": {}\n'.format(key, e.args[0]))
+            return
+
+        installer = self._installer_context.get_installer(rule_installer)
+        resolved = installer.resolve(rule)
+        return {installer: resolved}
+
+
+def resolve_rosdep_key(key, quiet=False):
+    return RosdepResolver(quiet=quiet).resolve(key)
 
 
 class RosdepTracer(DependencyTracer):
 
-    def __init__(self, apt_cache=None, quiet=True):
+    def __init__(
+            self, apt_cache=None, quiet=True, resolver=None, apt_backend=None,
+            apt_dependency_types=None):
         self._quiet = quiet
-        self._tracer = AptTracer(apt_cache=apt_cache, quiet=self._quiet)
-
-    def trace_paths(self, start, target, cache=None):
-        start_node = Node(start, ROSDEP_NODE)
+        self._tracer = AptTracer(
+            apt_cache=apt_cache, quiet=self._quiet, backend=apt_backend,
+            dependency_types=apt_dependency_types)
+        if resolver is None:
+            resolver = RosdepResolver(quiet=self._quiet)
+        self._resolver = resolver
+
+    def trace_targets(self, start, targets, cache=None):
         if not cache:
             cache = TracerCache()
-        if cache.check_fully_explored(start_node):
-            return [e for e in cache.recursive_edges(start_node)]
-        if not is_rosdep_initialized():
+        start_node, bits, _ = self.trace_into_cache(start, targets, cache)
+        return paths_to_targets(start_node, bits, APT_NODE, cache)
+
+    def trace_into_cache(self, start, targets, cache):
+        start_node = Node(start, ROSDEP_NODE)
+        bits = cache.target_bits(targets)
+        target_mask = apt_targets(bits)
+        if not cache.check_fully_explored(start_node):
+            for target in targets:
+                self._tracer.check_in_apt_cache(target)
+            trace(start_node, target_mask, self.successors, cache)
+        return start_node, bits, target_mask
+
+    def depends_on_any(self, start, targets, cache=None):
+        for target in targets:
+            self._tracer.check_in_apt_cache(target)
+        return reaches_target(
+            Node(start, ROSDEP_NODE), apt_targets(dict((t, 1) for t in targets)),
+            self.successors, verdict=cached_verdicts(cache, targets))
+
+    def trace_shortest_paths(self, start, target, k=1, cache=None):
+        self._tracer.check_in_apt_cache(target)
+        return shortest_paths(
+            Node(start, ROSDEP_NODE), apt_targets({target: 1}), self.successors,
+            k=k, is_dead_end=known_dead_ends(cache, target))
+
+    def check_in_apt_cache(self, name):
+        self._tracer.check_in_apt_cache(name)
+
+    def successors(self, node):
+        if node.node_type != ROSDEP_NODE:
+            return self._tracer.successors(node)
+        return self._rosdep_successors(node.name)
+
+    def _rosdep_successors(self, key):
+        if not self._resolver.is_initialized():
             msg = ('The rosdep database is not ready to be used. '
                 'Run \n\n\trosdep resolve {}\n\n'
-                'for instructions on how to fix this.\n'.format(start))
+                'for instructions on how to fix this.\n'.format(key))
             if not self._quiet:
                 print(msg)
             raise KeyError(msg)
 
-        resolved = resolve_rosdep_key(start)
+        resolved = self._resolver.resolve(key)
         if resolved is None:
-            msg = 'Could not resolve rosdep key {}\n'.format(start)
+            msg = 'Could not resolve rosdep key {}\n'.format(key)
             if not self._quiet:
                 print(msg)
             raise KeyError(msg)
@@ -128,22 +293,13 @@ class RosdepTracer(DependencyTracer):
             if isinstance(installer, AptInstaller):
                 apt_depends = pkgs
 
-        all_paths = []
         if not apt_depends:
             if not self._quiet:
                 sys.stderr.write(
-                    '{} did not resolve to an apt package\n'.format(start))
-        else:
-            for apt_depend in apt_depends:
-                paths = self._tracer.trace_paths(apt_depend, target, cache=cache)
-                if paths:
-                    apt_node = Node(apt_depend, APT_NODE)
-                    edge = Edge(start_node, 'rosdep', apt_node)
-                    cache.add_edge(edge)
-                    paths.append(edge)
-                    all_paths.extend(paths)
-        cache.mark_leads_to_target(start_node, bool(all_paths))
-        return all_paths
+                    '{} did not resolve to an apt package\n'.format(key))
+        for apt_depend in apt_depends:
+            self._tracer.check_in_apt_cache(apt_depend)
+        return [('rosdep', Node(apt_depend, APT_NODE)) for apt_depend in apt_depends]
 
 
 ROSDEP_EDGE_LEGEND = {
@@ -156,10 +312,11 @@ ROSDEP_NODE_LEGEND = {
 
 
 class CheckRosdepCommand:
-    COMMAND_NAME='check-rosdep'
-    COMMAND_HELP='check if rosdep key depends on python 2'
 
-    def __init__(self, parser):
+    def __init__(self, parser, resources=None):
+        if resources is None:
+            resources = Resources()
+        self._resources = resources
         # arguments for key, quiet, and dot output
         parser.add_argument(
             'key', type=str,
@@ -167,33 +324,101 @@ class CheckRosdepCommand:
         parser.add_argument('--quiet', action='store_true')
         parser.add_argument(
             '--dot', action='store_true', help='output DOT graph')
+        add_json_lines_argument(parser)
         parser.add_argument(
-            '--target', default='python',
-            help='Debian package to trace to (default python)')
+            '--target', action='append',
+            help='Debian package to trace to, may be given more than once (default python)')
+        parser.add_argument(
+            '--no-cache', action='store_true',
+            help='do not read or write results cached by previous runs')
+        add_apt_dependency_type_argument(parser)
+        add_shortest_argument(parser)
+        add_fail_fast_argument(parser)
 
     def do_command(self, args):
-        tracer = RosdepTracer(quiet=args.quiet)
+        targets = args.target or ['python']
+        shortest = shortest_count(args)
+        if shortest is not None and shortest < 1:
+            sys.stderr.write('--shortest-count must be at least 1\n')
+            return 2
+        if args.dot and args.jsonl:
+            sys.stderr.write('--dot can not be used with --jsonl\n')
+            return 2
+        graph = args.dot or args.jsonl
+        if args.fail_fast and (graph or shortest is not None):
+            sys.stderr.write(
+                '--fail-fast can not be used with --dot, --jsonl, or --shortest\n')
+            return 2
+        tracer = RosdepTracer(
+            quiet=args.quiet,
+            resolver=self._resources.rosdep_resolver(quiet=args.quiet),
+            apt_backend=self._resources.apt_backend(),
+            apt_dependency_types=args.dependency_type)
+
+        disk_cache = None
+        if args.no_cache:
+            cache = TracerCache()
+        else:
+            disk_cache = self._resources.results_cache(create_rosdep_disk_cache(
+                targets, quiet=args.quiet, apt_dependency_types=args.dependency_type))
+            cache = disk_cache.load()
+
+        if args.fail_fast:
+            try:
+                depends = tracer.depends_on_any(args.key, targets, cache=cache)
+            except (KeyError, ValueError):
+                return 2
+            if depends:
+                if not args.quiet:
+                    print('rosdep key {} depends on {}'.format(args.key, ' or '.join(targets)))
+                return 1
+            if not args.quiet:
+                print('rosdep key {} does not depend on {}'.format(
+                    args.key, ' or '.join(targets)))
+            return 0
 
         try:
-            all_paths = tracer.trace_paths(args.key, args.target)
-        except KeyError:
+            if shortest is not None:
+                chains = tracer.trace_shortest_targets(
+                    args.key, targets, k=shortest, cache=cache)
+                all_paths = dict(
+                    (target, [edge for chain in chains[target] for edge in chain])
+                    for target in targets)
+            else:
+                # Edges are read from the cache if they're needed
+                all_paths = tracer.trace_verdicts(args.key, targets, cache=cache)
+        except (KeyError, ValueError):
             return 2
 
-        if args.dot:
+        if disk_cache is not None:
+            disk_cache.save(cache)
+
+        if graph:
+            if shortest is not None:
+                edges = set(edge for target in targets for edge in all_paths[target])
+            else:
+                bits = cache.target_bits(targets)
+                edges = cache.edges_to_targets(
+                    [Node(args.key, ROSDEP_NODE)],
+                    dict((Node(t, APT_NODE), bits[t]) for t in targets))
             edge_legend = {}
             edge_legend.update(APT_EDGE_LEGEND)
             edge_legend.update(ROSDEP_EDGE_LEGEND)
-            print(
-                paths_to_dot(list(set(all_paths)),
+            write_graph(
+                edges, sys.stdout, json_lines=args.jsonl,
                 edge_legend=edge_legend,
-                node_legend=ROSDEP_NODE_LEGEND))
+                node_legend=ROSDEP_NODE_LEGEND)
+        elif not args.quiet and shortest is not None:
+            for target in targets:
+                print_shortest_paths('rosdep key ' + args.key, target, chains[target])
         elif not args.quiet:
-            if all_paths:
-                print('rosdep key {} depends on {}'.format(args.key, args.target))
-            else:
-                print('rosdep key {} does not depend on {}'.format(args.key, args.target))
+            for target in targets:
+                if all_paths[target]:
+                    print('rosdep key {} depends on {}'.format(args.key, target))
+                else:
+                    print('rosdep key {} does not depend on {}'.format(args.key, target))
 
-        if all_paths:
+        if any(all_paths.values()):
             # non-zero exit code to indicate it does depend on target
             # because it's assumed depending on target is undesirable
             return 1
@@ -0,0 +1,335 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Answer check commands sent by `py3-ready query` with databases kept loaded.
+
+Commands are run one at a time in the server process, so the apt cache, the
+rosdep database, parsed package.xml files, and traced results are loaded
+once and reused until the files they were read from change.
+"""
+
+from __future__ import print_function
+
+import argparse
+import errno
+import os
+import socket
+import sys
+import traceback
+
+from .apt_backend import get_apt_database_paths
+from .cli import add_stats_argument
+from .cli import COMMANDS
+from .cli import load_command_class
+from .cli import run_command
+from .client import add_socket_argument
+from .client import default_socket_path
+from .client import read_message
+from .client import send_message
+from .client import SERVED_COMMANDS
+from .disk_cache import fingerprint_paths
+from .resources import Resources
+
+# Output is sent to the client in pieces about this big
+SEND_SIZE = 64 * 1024
+
+
+class ResidentResources(Resources):
+    """Resources kept loaded between commands.
+
+    Each is checked against the files it was read from before it's handed
+    out, and only the ones whose files changed are loaded again.
+    """
+
+    def __init__(self):
+        # Key: snapshot path or None for the apt cache, Value: (fingerprint, backend)
+        self._apt_backends = {}
+        # Key: (rosdep environment, quiet), Value: (fingerprint, resolver)
+        self._resolvers = {}
+        # Key: prefix environment, Value: (fingerprint, package cache)
+        self._package_caches = {}
+        # Key: name of a persistent cache, Value: _ResidentEntry
+        self._results = {}
+
+    def apt_backend(self, snapshot=None):
+        if snapshot is not None:
+            snapshot = os.path.abspath(snapshot)
+            fingerprint = fingerprint_paths([snapshot])
+        else:
+            fingerprint = fingerprint_paths(get_apt_database_paths())
+        old = self._apt_backends.get(snapshot)
+        if old is not None and old[0] == fingerprint:
+            return old[1]
+        backend = super(ResidentResources, self).apt_backend(snapshot)
+        self._apt_backends[snapshot] = (fingerprint, backend)
+        return backend
+
+    def rosdep_resolver(self, quiet=True):
+        from .rosdep import get_rosdep_environment
+        from rosdep2.sources_list import get_sources_cache_dir
+        fingerprint = fingerprint_paths([get_sources_cache_dir()])
+        key = (tuple(get_rosdep_environment()), quiet)
+        old = self._resolvers.get(key)
+        if old is not None and old[0] == fingerprint:
+            return old[1]
+        resolver = super(ResidentResources, self).rosdep_resolver(quiet)
+        self._resolvers[key] = (fingerprint, resolver)
+        return resolver
+
+    def package_cache(self, use_disk_cache=False, quiet=True, lazy=False):
+        from .package_xml import PREFIX_PATH_ENV_VARS
+        # Every package is found up front even for --lazy, since that's only
+        # done once. Parsed package.xml files are checked before being reused,
+        # so they are kept even with --no-cache.
+        key = tuple(os.getenv(var, '') for var in PREFIX_PATH_ENV_VARS)
+        old = self._package_caches.get(key)
+        if old is not None and old[0] == old[1].fingerprint():
+            return old[1]
+        # Only package.xml files that changed are parsed again
+        package_cache = super(ResidentResources, self).package_cache(
+            use_disk_cache=True, quiet=quiet)
+        self._package_caches[key] = (package_cache.fingerprint(), package_cache)
+        return package_cache
+
+    def results_cache(self, disk_cache):
+        return _ResidentResults(disk_cache, self._results)
+
+
+class _ResidentEntry(object):
+
+    def __init__(self, fingerprint, cache, metadata, saved_nodes):
+        self.fingerprint = fingerprint
+        self.cache = cache
+        self.metadata = metadata
+        # Number of fully explored nodes when it was last saved to disk
+        self.saved_nodes = saved_nodes
+
+
+class _ResidentResults(object):
+    """Results of a PersistentTracerCache kept in memory between commands.
+
+    They're loaded from disk the first time, and again when the databases
+    they were traced from change.
+    Saving writes them to disk too so runs not using the server see them.
+    """
+
+    def __init__(self, disk_cache, entries):
+        self._disk_cache = disk_cache
+        self._entries = entries
+        self.metadata = None
+
+    def load(self):
+        fingerprint = self._disk_cache.fingerprint()
+        entry = self._entries.get(self._disk_cache.name)
+        if entry is None or entry.fingerprint != fingerprint:
+            cache = self._disk_cache.load()
+            entry = _ResidentEntry(
+                fingerprint, cache, self._disk_cache.metadata, cache.num_explored())
+            self._entries[self._disk_cache.name] = entry
+        self.metadata = entry.metadata
+        return entry.cache
+
+    def save(self, cache, metadata=None):
+        entry = self._entries[self._disk_cache.name]
+        if cache.num_explored() == entry.saved_nodes and metadata == entry.metadata:
+            # Nothing new was learned
+            return
+        self._disk_cache.save(cache, metadata)
+        entry.metadata = metadata
+        entry.saved_nodes = cache.num_explored()
+
+
+class _ForwardedOutput(object):
+    """Sends what a command writes to stdout and stderr to the client.
+
+    Both streams share one buffer so the client sees them in the order
+    they were written.
+    """
+
+    def __init__(self, fout):
+        self._fout = fout
+        # (stream name, [pieces of text])
+        self._pending = None
+        self._pending_size = 0
+
+    def stream(self, name):
+        return _ForwardedStream(self, name)
+
+    def write(self, name, text):
+        if self._pending is not None and self._pending[0] != name:
+            self.flush()
+        if self._pending is None:
+            self._pending = (name, [])
+        self._pending[1].append(text)
+        self._pending_size += len(text)
+        if self._pending_size >= SEND_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self._pending is not None:
+            name, pieces = self._pending
+            self._pending = None
+            self._pending_size = 0
+            send_message(self._fout, {name: ''.join(pieces)})
+
+
+class _ForwardedStream(object):
+
+    def __init__(self, output, name):
+        self._output = output
+        self._name = name
+
+    def write(self, text):
+        if isinstance(text, bytes) and not isinstance(text, str):
+            text = text.decode('utf-8')
+        self._output.write(self._name, text)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+class Server(object):
+    """Runs check commands sent over a Unix socket, one at a time."""
+
+    def __init__(self, socket_path, quiet=True):
+        self._socket_path = socket_path
+        self._quiet = quiet
+        self._resources = ResidentResources()
+        # Key: command name, Value: (parser, command)
+        self._commands = {}
+
+    def _get_command(self, name):
+        if name not in self._commands:
+            for command_name, _, module_name, class_name, requirements in COMMANDS:
+                if command_name == name:
+                    break
+            cmd_class = load_command_class(module_name, class_name, requirements)
+            parser = argparse.ArgumentParser(prog='py3-ready ' + name)
+            add_stats_argument(parser)
+            self._commands[name] = (parser, cmd_class(parser, resources=self._resources))
+        return self._commands[name]
+
+    def run(self, argv):
+        """Run a command, returning its exit code, like running py3-ready with argv."""
+        if not argv or argv[0] not in SERVED_COMMANDS:
+            sys.stderr.write('py3-ready serve only runs {}\n'.format(', '.join(SERVED_COMMANDS)))
+            return 2
+        try:
+            parser, cmd = self._get_command(argv[0])
+            args = parser.parse_args(argv[1:])
+            return run_command(cmd.do_command, args)
+        except SystemExit as e:
+            # Raised by argparse, and when a needed module isn't installed
+            if e.code is None:
+                return 0
+            if isinstance(e.code, int):
+                return e.code
+            sys.stderr.write(str(e.code) + '\n')
+            return 1
+        except Exception:
+            # Same exit code as python gives an uncaught exception
+            traceback.print_exc()
+            return 1
+
+    def handle(self, conn):
+        fin = conn.makefile('rb')
+        fout = conn.makefile('wb')
+        request = read_message(fin)
+        if request is None:
+            return
+
+        # Run the command as if it was run where the client is
+        os.chdir(request['cwd'])
+        for var, value in request['env'].items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
+
+        output = _ForwardedOutput(fout)
+        old_stdout, old_stderr = sys.stdout, sys.stderr
+        sys.stdout = output.stream('stdout')
+        sys.stderr = output.stream('stderr')
+        try:
+            code = self.run(request['argv'])
+        finally:
+            sys.stdout, sys.stderr = old_stdout, old_stderr
+        output.flush()
+        send_message(fout, {'exit': code})
+
+    def _listen(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.bind(self._socket_path)
+        except socket.error as e:
+            if e.errno != errno.EADDRINUSE:
+                raise
+            # Left behind by a server that didn't exit cleanly, unless
+            # another server is still using it
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self._socket_path)
+            except socket.error:
+                os.remove(self._socket_path)
+                sock.bind(self._socket_path)
+            else:
+                raise
+            finally:
+                probe.close()
+        sock.listen(16)
+        return sock
+
+    def serve_forever(self):
+        socket_dir = os.path.dirname(self._socket_path)
+        if socket_dir and not os.path.isdir(socket_dir):
+            os.makedirs(socket_dir)
+        sock = self._listen()
+        try:
+            if not self._quiet:
+                sys.stderr.write('Listening on {}\n'.format(self._socket_path))
+            while True:
+                conn, _ = sock.accept()
+                try:
+                    self.handle(conn)
+                except (IOError, OSError, socket.error) as e:
+                    # Most likely the client went away before the command finished
+                    if not self._quiet:
+                        sys.stderr.write('Failed to answer a query: {}\n'.format(e))
+                finally:
+                    conn.close()
+        finally:
+            sock.close()
+            os.remove(self._socket_path)
+
+
+class ServeCommand(object):
+
+    def __init__(self, parser):
+        add_socket_argument(parser)
+        parser.add_argument('--quiet', action='store_true')
+
+    def do_command(self, args):
+        server = Server(args.socket or default_socket_path(), quiet=args.quiet)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        except socket.error as e:
+            sys.stderr.write('Could not listen on {}: {}\n'.format(
+                args.socket or default_socket_path(), e))
+            return 2
+        return 0
@@ -0,0 +1,112 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Counters and timers showing where a run spends its time."""
+
+from contextlib import contextmanager
+import json
+import timeit
+
+
+class Stats(object):
+    """Counts events and times phases of a run.
+
+    Phases may be nested, and time spent in an inner phase is not counted
+    in the outer one, so the times of all phases add up to the whole run.
+    """
+
+    def __init__(self):
+        # Key: name, Value: count
+        self.counters = {}
+        # Key: phase, Value: seconds
+        self.phases = {}
+        # Phases being timed, innermost last
+        self._running = []
+        self._started = None
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_time(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def _charge(self):
+        now = timeit.default_timer()
+        if self._running:
+            self.add_time(self._running[-1], now - self._started)
+        self._started = now
+
+    @contextmanager
+    def phase(self, name):
+        self._charge()
+        self._running.append(name)
+        try:
+            yield
+        finally:
+            self._charge()
+            self._running.pop()
+
+    def as_dict(self):
+        return {'phases': self.phases, 'counters': self.counters}
+
+    def write_json(self, fout):
+        fout.write(json.dumps(self.as_dict(), indent=2, sort_keys=True) + '\n')
+
+    def write_summary(self, fout):
+        rows = [('phase', 'seconds')]
+        for phase, seconds in sorted(self.phases.items(), key=lambda item: -item[1]):
+            rows.append((phase, '{:.3f}'.format(seconds)))
+        rows.append(('', ''))
+        rows.append(('counter', 'count'))
+        for name, value in sorted(self.counters.items()):
+            rows.append((name, str(value)))
+        width = max(len(row[0]) for row in rows)
+        for name, value in rows:
+            fout.write('{name:<{width}}  {value:>10}\n'.format(
+                name=name, width=width, value=value).rstrip() + '\n')
+
+
+class _NullStats(Stats):
+    """Stats that ignores everything, used when --stats isn't given."""
+
+    def count(self, name, n=1):
+        pass
+
+    def add_time(self, phase, seconds):
+        pass
+
+    @contextmanager
+    def phase(self, name):
+        yield
+
+
+_current = _NullStats()
+
+
+def current_stats():
+    """Return the Stats of this run, which ignores everything unless enabled."""
+    return _current
+
+
+def enable_stats():
+    """Start collecting stats for this process and return them."""
+    global _current
+    _current = Stats()
+    return _current
+
+
+def disable_stats():
+    """Stop collecting stats for this process."""
+    global _current
+    _current = _NullStats()
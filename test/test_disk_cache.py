@@ -0,0 +1,63 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+
+from py3_ready.dependency_tracer import Node
+from py3_ready.dependency_tracer import TracerCache
+from py3_ready.disk_cache import PersistentTracerCache
+
+
+def _make_cache():
+    cache = TracerCache()
+    bits = cache.target_bits(['python'])
+    cache.add_edge_between(Node('app', 'apt'), 'Depends', Node('lib', 'apt'))
+    cache.add_edge_between(Node('lib', 'apt'), 'Depends', Node('python', 'apt'))
+    cache.mark_targets_reached(Node('python', 'apt'), bits['python'])
+    cache.mark_targets_reached(Node('lib', 'apt'), bits['python'])
+    cache.mark_targets_reached(Node('app', 'apt'), bits['python'])
+    cache.mark_targets_reached(Node('other', 'apt'), 0)
+    return cache
+
+
+def test_save_load_round_trip():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        database = os.path.join(tmp_dir, 'database')
+        with open(database, 'w') as fout:
+            fout.write('packages')
+        cache_dir = os.path.join(tmp_dir, 'cache')
+
+        cache = _make_cache()
+        assert cache.num_explored() == 4
+        PersistentTracerCache(
+            'test', [database], cache_dir=cache_dir).save(cache, metadata={'a': 1})
+
+        disk_cache = PersistentTracerCache('test', [database], cache_dir=cache_dir)
+        loaded = disk_cache.load()
+        assert loaded.num_explored() == 4
+        assert disk_cache.metadata == {'a': 1}
+        assert loaded.check_targets_reached(Node('app', 'apt')) == 1
+        assert loaded.check_targets_reached(Node('other', 'apt')) == 0
+        assert loaded.export_data() == cache.export_data()
+
+        # Results are thrown away when the database changes
+        with open(database, 'w') as fout:
+            fout.write('other packages')
+        loaded = PersistentTracerCache('test', [database], cache_dir=cache_dir).load()
+        assert loaded.num_explored() == 0
+    finally:
+        shutil.rmtree(tmp_dir)